@@ -1,246 +1,518 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-import requests
-import random
+from contextlib import asynccontextmanager
+from fastapi import Body, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from datetime import datetime, timezone
+import asyncio
+import math
 import os
-import subprocess
-import uuid
 
-app = FastAPI()
+import cache
+import delivery
+import feeds
+import health
+import metrics
+import music
+import muxcache
+import proxycache
+import searchindex
+import shared
+import suggest
+import videoinfo
+import mux
+from jobs import QueueFull, scheduler
+from mux import (
+    mux_plan,
+    mux_segment,
+    mux_video_audio_ios,
+    segment_args,
+    stream_video_audio_ios,
+)
+from upstream import try_json, hedged_json, flights, probe_loop, close_clients
+from sources import (
+    CACHE_TTL,
+    COMMENTS_APIS,
+    LATENCY_BUDGET,
+    SEARCH_APIS,
+    VIDEO_APIS,
+    get_video_info,
+    proxy_format,
+    search_accept,
+)
+
+@asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(muxcache.cleanup)
+    await asyncio.to_thread(proxycache.cleanup)
+
+    probe = None
+    if health.PROBE_INTERVAL > 0:
+        bases = list(dict.fromkeys(VIDEO_APIS + COMMENTS_APIS))
+        probe = asyncio.create_task(probe_loop(bases, health.PROBE_INTERVAL))
+
+    indexer = asyncio.create_task(searchindex.flush_loop())
+
+    try:
+        suggest.add_videos(searchindex.popular(suggest.MAX_TERMS // 2))
+    except Exception as e:
+        print("suggest seed error:", e)
+    compactor = asyncio.create_task(suggest.compact_loop())
+    refresher = asyncio.create_task(feeds.refresh_loop(channel_videos_page))
+    sharer = asyncio.create_task(shared.flush_loop())
+    purger = asyncio.create_task(shared.purge_loop())
+
+    yield
+
+    if probe:
+        probe.cancel()
+    compactor.cancel()
+    refresher.cancel()
+    purger.cancel()
+    indexer.cancel()
+    sharer.cancel()
+    await asyncio.gather(indexer, sharer, return_exceptions=True)
+    searchindex.close()
+    shared.close()
+    await close_clients()
+
+app = FastAPI(lifespan=lifespan, default_response_class=delivery.FastJSONResponse)
+app.add_middleware(metrics.RequestMetrics)
+app.add_middleware(delivery.Compression)
 
 # ===============================
 # Static
 # ===============================
 # Render で statics が無くても即死しないようにする
 if os.path.isdir("statics"):
-    app.mount("/static", StaticFiles(directory="statics"), name="static")
-
-    # ★ 仙人music
-    if os.path.isdir("statics/music"):
-        app.mount("/music", StaticFiles(directory="statics/music", html=True), name="music")
-    else:
-        print("⚠ statics/music directory not found (skipped mount)")
+    app.mount("/static", delivery.CachedStaticFiles(directory="statics"), name="static")
 else:
     print("⚠ statics directory not found (skipped mount)")
 
 @app.get("/")
 def root():
     if os.path.isfile("statics/index.html"):
-        return FileResponse("statics/index.html")
+        return FileResponse(
+            "statics/index.html",
+            headers={"Cache-Control": f"public, max-age={delivery.STATIC_MAX_AGE}"},
+        )
     return {"status": "index.html not found"}
 
 # ===============================
 # API BASE LIST
 # ===============================
-VIDEO_APIS = [
-    "https://iv.melmac.space",
-    "https://pol1.iv.ggtyler.dev",
-    "https://cal1.iv.ggtyler.dev",
-    "https://invidious.0011.lt",
-    "https://yt.omada.cafe",
-]
-
-SEARCH_APIS = VIDEO_APIS
-
-COMMENTS_APIS = [
-    "https://invidious.lunivers.trade",
-    "https://invidious.ducks.party",
-    "https://super8.absturztau.be",
-    "https://invidious.nikkosphere.com",
-    "https://yt.omada.cafe",
-    "https://iv.melmac.space",
-    "https://iv.duti.dev",
-]
-
+# Invidious のインスタンス一覧・レイテンシ予算・キャッシュ TTL は sources.py
 EDU_STREAM_API_BASE_URL = "https://raw.githubusercontent.com/toka-kun/Education/refs/heads/main/keys/key1.json"
 STREAM_YTDL_API_BASE_URL = "https://yudlp.vercel.app/stream/"
 SHORT_STREAM_API_BASE_URL = "https://yt-dl-kappa.vercel.app/short/"
 
-TIMEOUT = 6
+# 連合検索で同時に問い合わせるインスタンス数と締め切り（秒）
+SEARCH_FANOUT = 3
+SEARCH_DEADLINE = 4
+# Reciprocal Rank Fusion の定数
+SEARCH_RRF_K = 60
+
+# /api/videos で一度に受け付ける ID 数と、インスタンスごとの同時リクエスト数・試すインスタンス数
+BATCH_MAX_IDS = 50
+BATCH_PER_INSTANCE = 4
+BATCH_ATTEMPTS = 3
 
-HEADERS = {
-    "User-Agent": "Mozilla/5.0"
-}
+# コメントの NDJSON ストリームで 1 回に辿る最大ページ数
+COMMENTS_STREAM_PAGES = 10
+
+# HLS のセグメント長（秒）と、再生位置より先に作っておくセグメント数
+HLS_SEGMENT_SECONDS = 6
+HLS_PREFETCH = 3
 
 # ===============================
 # Utils
 # ===============================
-def try_json(url, params=None):
-    try:
-        r = requests.get(url, params=params, headers=HEADERS, timeout=TIMEOUT)
-        if r.status_code == 200:
-            return r.json()
-    except Exception as e:
-        print("request error:", e)
-    return None
+# iOS でそのまま再生できる avc1 / mp4a を優先して、(映像 format, 音声 format) を返す
+def pick_video_audio(table, quality="best", lang=None):
+    return (
+        table.video(quality, prefer_ios=True),
+        table.audio(lang, prefer_ios=True),
+    )
+
+def pick_stream_urls(table, quality="best", lang=None):
+    video = table.video(quality)
+    audio = table.audio(lang)
+
+    return (
+        video["url"] if video else None,
+        audio["url"] if audio else None,
+    )
 
-def pick_video_audio(formats, quality="best"):
-    video_url = None
-    audio_url = None
+# ===============================
+# Search
+# ===============================
+def search_results(data):
+    results = []
 
-    for f in formats:
-        if f.get("type", "").startswith("video") and f.get("url"):
-            if quality == "best" or quality in (f.get("qualityLabel") or ""):
-                video_url = f["url"]
-                break
+    for v in data or []:
+        if not isinstance(v, dict) or not v.get("videoId"):
+            continue
 
-    for f in formats:
-        if f.get("type", "").startswith("audio") and f.get("url"):
-            lang = (f.get("language") or "").lower()
-            if "en" in lang:
-                continue
-            audio_url = f["url"]
-            break
+        results.append({
+            "videoId": v.get("videoId"),
+            "title": v.get("title"),
+            "author": v.get("author"),
+            "authorId": v.get("authorId"),
+        })
 
-    return video_url, audio_url
-
-def mux_video_audio_ios(video_url, audio_url):
-    out = f"/tmp/{uuid.uuid4()}.mp4"
-
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-i", video_url,
-        "-i", audio_url,
-        "-map", "0:v:0",
-        "-map", "1:a:0",
-        "-c:v", "libx264",
-        "-profile:v", "main",
-        "-level", "3.1",
-        "-pix_fmt", "yuv420p",
-        "-c:a", "aac",
-        "-movflags", "+faststart",
-        out
-    ]
+    return results
 
-    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+def search_key(q, page, federated):
+    return f"search:{q}:{page}" + (":fed" if federated else "")
 
-    return out
+async def search_page(q, page):
+    data, base = await hedged_json(
+        health.order(SEARCH_APIS),
+        "/api/v1/search",
+        {"q": q, "type": "video", "page": page},
+        accept=search_accept,
+        budget=LATENCY_BUDGET["search"],
+    )
 
-# ===============================
-# Search
-# ===============================
-@app.get("/api/search")
-def api_search(q: str):
-    results = []
-    random.shuffle(SEARCH_APIS)
+    searchindex.add(data)
+    results = search_results(data)
+
+    if results:
+        return {
+            "count": len(results),
+            "results": results,
+            "source": base
+        }
+
+# 健康なインスタンス数台に同時に投げ、締め切りまでに返ってきた分を
+# videoId で重複除去して RRF で並べる。前のページで出した動画は除く
+async def federated_search_page(q, page):
+    bases = health.order(SEARCH_APIS)[:SEARCH_FANOUT]
+    params = {"q": q, "type": "video", "page": page}
+
+    tasks = [
+        (base, asyncio.create_task(try_json(f"{base}/api/v1/search", params)))
+        for base in bases
+    ]
+    await asyncio.wait([t for _, t in tasks], timeout=SEARCH_DEADLINE)
+
+    seen = set()
+    for p in range(1, page):
+        entry = cache.responses.get(search_key(q, p, True))
+        if entry and entry[0]:
+            seen.update(r["videoId"] for r in entry[0]["results"])
 
-    for base in SEARCH_APIS:
-        data = try_json(f"{base}/api/v1/search", {"q": q, "type": "video"})
-        if not isinstance(data, list):
+    items = {}
+    scores = {}
+    sources = []
+
+    for base, task in tasks:
+        if not task.done():
+            task.cancel()
             continue
 
-        for v in data:
-            if not v.get("videoId"):
+        searchindex.add(task.result())
+        results = search_results(task.result())
+        if results:
+            sources.append(base)
+
+        for rank, r in enumerate(results):
+            vid = r["videoId"]
+            if vid in seen:
                 continue
+            items.setdefault(vid, r)
+            scores[vid] = scores.get(vid, 0) + 1 / (SEARCH_RRF_K + rank)
+
+    if not items:
+        # 全滅なら残りのインスタンスで通常の検索にフォールバック
+        return await search_page(q, page)
+
+    # sorted は安定なので同点は最初に見えた順のまま
+    results = sorted(items.values(), key=lambda r: -scores[r["videoId"]])
+
+    return {
+        "count": len(results),
+        "results": results,
+        "source": sources
+    }
+
+# これまでに見た動画からローカルで探す。上流には行かない
+async def local_search_page(q, page):
+    results = await searchindex.search(q, page)
+    return {
+        "count": len(results),
+        "results": results,
+        "source": "local"
+    }
 
-            results.append({
-                "videoId": v.get("videoId"),
-                "title": v.get("title"),
-                "author": v.get("author"),
-                "authorId": v.get("authorId"),
-            })
+@app.get("/api/search")
+async def api_search(request: Request, q: str, page: int = 1, federated: bool = False, local: bool = False):
+    page = max(page, 1)
 
-        if results:
-            return {
-                "count": len(results),
-                "results": results,
-                "source": base
-            }
+    if local:
+        return delivery.json_response(
+            request, {**await local_search_page(q, page), "page": page, "nextPage": page + 1}, "local"
+        )
+
+    fetch_page = federated_search_page if federated else search_page
+
+    result, status = await cache.cached(
+        search_key(q, page, federated),
+        CACHE_TTL["search"],
+        lambda: fetch_page(q, page),
+        negative=True,
+    )
+    if result is None:
+        # 上流が全滅ならローカルの索引で答える
+        result, status = await local_search_page(q, page), "local"
+        if not result["results"]:
+            raise HTTPException(status_code=503, detail="Search unavailable")
+
+    # 結果のあったクエリだけをサジェストに入れる（打ち間違いは候補にしない）
+    if page == 1 and result["results"]:
+        suggest.add_query(q)
+        if status == cache.MISS:
+            suggest.add_videos(result["results"])
+
+    # 上流から取れたときだけ次のページを裏で取っておく（スクロールしたときにメモリから返せるように）。
+    # 最後のページの次は空なので、取れなかったことも短くキャッシュしてヒットのたびに上流へ行かない
+    if status == cache.MISS:
+        cache.prefetch(
+            search_key(q, page + 1, federated),
+            CACHE_TTL["search"],
+            lambda: fetch_page(q, page + 1),
+            negative=True,
+        )
+
+    return delivery.json_response(request, {**result, "page": page, "nextPage": page + 1}, status)
 
-    raise HTTPException(status_code=503, detail="Search unavailable")
+# ===============================
+# Suggest
+# ===============================
+@app.get("/api/suggest")
+async def api_suggest(q: str, limit: int = 10):
+    return {"q": q, "suggestions": suggest.suggest(q, min(max(limit, 1), 20))}
 
 # ===============================
 # Video Info
 # ===============================
+async def video_result(video_id, get_info=get_video_info):
+    info = await get_info(video_id)
+
+    if info:
+        searchindex.add([{"videoId": video_id, **info.meta}])
+        suggest.add_videos([info.meta])
+        return {
+            "title": info.meta.get("title"),
+            "author": info.meta.get("author"),
+            "description": info.meta.get("description"),
+            "viewCount": info.meta.get("viewCount"),
+            "lengthSeconds": info.meta.get("lengthSeconds"),
+            "source": info.base
+        }
+
+async def cached_video(video_id, get_info=get_video_info):
+    return await cache.cached(
+        f"video:{video_id}",
+        CACHE_TTL["video"],
+        lambda: video_result(video_id, get_info),
+    )
+
 @app.get("/api/video")
-def api_video(video_id: str):
-    random.shuffle(VIDEO_APIS)
+async def api_video(request: Request, video_id: str):
+    result, status = await cached_video(video_id)
+    if result is None:
+        raise HTTPException(status_code=503, detail="Video info unavailable")
+
+    # 動画ページはこのあとコメントも読むので、上流から取った（初めて見た）動画なら先に取りに行っておく
+    if status == cache.MISS:
+        prefetch_comments(video_id)
 
-    for base in VIDEO_APIS:
-        data = try_json(f"{base}/api/v1/videos/{video_id}")
-        if data:
-            return {
-                "title": data.get("title"),
-                "author": data.get("author"),
-                "description": data.get("description"),
-                "viewCount": data.get("viewCount"),
-                "lengthSeconds": data.get("lengthSeconds"),
-                "source": base
-            }
+    return delivery.json_response(request, result, status)
 
-    raise HTTPException(status_code=503, detail="Video info unavailable")
+# ===============================
+# Video Info（まとめて）
+# ===============================
+_batch_slots = {}
+
+def batch_slot(base):
+    slot = _batch_slots.get(base)
+    if slot is None:
+        slot = _batch_slots[base] = asyncio.Semaphore(BATCH_PER_INSTANCE)
+    return slot
+
+# 割り当てられたインスタンスから順に、インスタンスごとの同時数を守って取る
+def batch_fetcher(video_id, bases):
+    async def fetch(upstream_accept):
+        for base in bases[:BATCH_ATTEMPTS]:
+            async with batch_slot(base):
+                data = await try_json(f"{base}/api/v1/videos/{video_id}")
+            if data and (upstream_accept or bool)(data):
+                return data, base
+        return None, None
+
+    return lambda vid: videoinfo.get(vid, fetch)
+
+async def batch_videos(ids):
+    ids = list(dict.fromkeys(i for i in ids if i))[:BATCH_MAX_IDS]
+    bases = health.order(VIDEO_APIS)
+
+    # キャッシュにあるものは上流に行かずにそのまま返る。
+    # 無いものは健康なインスタンスに順番に振り分けて同時に取る
+    async def one(n, video_id):
+        k = n % len(bases)
+        rotated = bases[k:] + bases[:k]
+        try:
+            return await cached_video(video_id, batch_fetcher(video_id, rotated))
+        except Exception as e:
+            print("batch video error:", video_id, e)
+            return None, cache.MISS
+
+    results = await asyncio.gather(*(one(n, i) for n, i in enumerate(ids)))
+
+    videos = {}
+    errors = {}
+    for video_id, (result, status) in zip(ids, results):
+        if result is None:
+            errors[video_id] = "unavailable"
+        else:
+            videos[video_id] = {**result, "cache": status}
+
+    return {"count": len(videos), "videos": videos, "errors": errors}
+
+@app.get("/api/videos")
+async def api_videos(ids: str):
+    return await batch_videos(ids.split(","))
+
+@app.post("/api/videos")
+async def api_videos_post(ids: list[str] = Body(..., embed=True)):
+    return await batch_videos(ids)
 
 # ===============================
 # Comments
 # ===============================
+def comments_key(video_id, continuation):
+    return f"comments:{video_id}:{continuation or ''}"
+
+async def comments_page(video_id, continuation=None):
+    data, base = await hedged_json(
+        health.order(COMMENTS_APIS),
+        f"/api/v1/comments/{video_id}",
+        {"continuation": continuation} if continuation else None,
+        accept=lambda d: isinstance(d, dict),
+        budget=LATENCY_BUDGET["comments"],
+    )
+
+    if data:
+        return {
+            "comments": [
+                {
+                    "author": c.get("author"),
+                    "content": c.get("content")
+                }
+                for c in data.get("comments", [])
+            ],
+            "continuation": data.get("continuation"),
+            "source": base
+        }
+
+# ページごとに (video_id, continuation) でキャッシュする
+async def cached_comments(video_id, continuation=None):
+    return await cache.cached(
+        comments_key(video_id, continuation),
+        CACHE_TTL["comments"],
+        lambda: comments_page(video_id, continuation),
+        negative=True,
+    )
+
+# コメントが無効な動画は上流がエラーを返すので、取れなかったことも短くキャッシュする
+def prefetch_comments(video_id):
+    cache.prefetch(
+        comments_key(video_id, None),
+        CACHE_TTL["comments"],
+        lambda: comments_page(video_id),
+        negative=True,
+    )
+
+# 1 ページ 1 行の NDJSON で、取れた端から continuation を辿って送る
+async def stream_comments(video_id, continuation, pages):
+    for _ in range(pages):
+        result, status = await cached_comments(video_id, continuation)
+        if result is None:
+            break
+
+        yield delivery.dumps({**result, "cache": status}) + b"\n"
+
+        continuation = result.get("continuation")
+        if not continuation:
+            break
+
 @app.get("/api/comments")
-def api_comments(video_id: str):
-    for base in COMMENTS_APIS:
-        data = try_json(f"{base}/api/v1/comments/{video_id}")
-        if data:
-            return {
-                "comments": [
-                    {
-                        "author": c.get("author"),
-                        "content": c.get("content")
-                    }
-                    for c in data.get("comments", [])
-                ],
-                "source": base
-            }
-    return {"comments": [], "source": None}
+async def api_comments(request: Request, video_id: str, continuation: str = None, stream: bool = False, pages: int = 3):
+    if stream:
+        return StreamingResponse(
+            stream_comments(video_id, continuation, min(max(pages, 1), COMMENTS_STREAM_PAGES)),
+            media_type="application/x-ndjson",
+        )
+
+    result, status = await cached_comments(video_id, continuation)
+    if result is None:
+        return delivery.json_response(
+            request, {"comments": [], "continuation": None, "source": None}, status
+        )
+
+    return delivery.json_response(request, result, status)
 
 # ===============================
 # Channel（完全版・修整済）
 # ===============================
+# UNIX 秒 / ISO 文字列のどちらでも ISO 8601 にする
+def iso_time(value):
+    if isinstance(value, str):
+        return value.replace("Z", "+00:00")
+    if isinstance(value, int) and value > 0:
+        return datetime.fromtimestamp(value, timezone.utc).isoformat()
+    return None
+
+def channel_video(v, author, c):
+    return {
+        "videoId": v.get("videoId"),
+        "title": v.get("title"),
+        "author": v.get("author") or author,
+        "authorId": c,
+        "viewCount": v.get("viewCount") or 0,
+        "viewCountText": v.get("viewCountText") or "0 回視聴",
+        "published": iso_time(v.get("published")),
+        "publishedText": v.get("publishedText") or ""
+    }
+
 @app.get("/api/channel")
-def api_channel(c: str):
-    random.shuffle(VIDEO_APIS)
+async def api_channel(request: Request, c: str):
+    async def fetch():
+        ch, base = await hedged_json(
+            health.order(VIDEO_APIS),
+            f"/api/v1/channels/{c}",
+            accept=lambda d: isinstance(d, dict),
+            budget=LATENCY_BUDGET["channel"],
+        )
 
-    for base in VIDEO_APIS:
-        ch = try_json(f"{base}/api/v1/channels/{c}")
         if not ch:
-            continue
+            return None
 
-        latest_videos = []
-
-        for v in ch.get("latestVideos", []):
-            published_raw = v.get("published")
-            published_iso = None
-
-            if isinstance(published_raw, str):
-                try:
-                    published_iso = published_raw.replace("Z", "+00:00")
-                except:
-                    published_iso = None
-
-            latest_videos.append({
-                "videoId": v.get("videoId"),
-                "title": v.get("title"),
-                "author": ch.get("author"),
-                "authorId": c,
-                "viewCount": v.get("viewCount") or 0,
-                "viewCountText": v.get("viewCountText") or "0 回視聴",
-                "published": published_iso,
-                "publishedText": v.get("publishedText") or ""
-            })
+        searchindex.add(ch.get("latestVideos"), author=ch.get("author"), author_id=c)
+        suggest.add_videos(ch.get("latestVideos"))
+        suggest.add(ch.get("author"), suggest.AUTHOR_WEIGHT)
+        latest_videos = [
+            channel_video(v, ch.get("author"), c)
+            for v in ch.get("latestVideos", [])
+        ]
 
-        view_count = ch.get("viewCount")
         video_count = ch.get("videoCount")
-        joined_date = ch.get("joinedDate")
-
         if not isinstance(video_count, int):
             video_count = len(latest_videos)
 
+        # joinedDate が無ければ開設日時（joined, UNIX 秒）から作る
+        joined_date = ch.get("joinedDate")
         if not isinstance(joined_date, str):
-            published_dates = [
-                v["published"]
-                for v in latest_videos
-                if isinstance(v.get("published"), str)
-            ]
-            joined_date = min(published_dates) if published_dates else None
+            joined_date = iso_time(ch.get("joined"))
 
         related_channels = []
 
@@ -264,7 +536,7 @@ def api_channel(c: str):
             "authorThumbnails": ch.get("authorThumbnails"),
             "description": ch.get("description") or "",
             "subCount": ch.get("subCount") or 0,
-            "viewCount": view_count or 0,
+            "viewCount": ch.get("viewCount") or 0,
             "videoCount": video_count,
             "joinedDate": joined_date,
             "latestVideos": latest_videos,
@@ -272,73 +544,403 @@ def api_channel(c: str):
             "source": base
         }
 
-    raise HTTPException(status_code=503, detail="Channel unavailable")
+    result, status = await cache.cached(f"channel:{c}", CACHE_TTL["channel"], fetch)
+    if result is None:
+        raise HTTPException(status_code=503, detail="Channel unavailable")
+
+    return delivery.json_response(request, result, status)
+
+# /api/v1/channels/{id}/videos の 1 ページ。continuation が無ければ先頭（新着）ページ
+async def channel_videos_page(c, continuation=None):
+    data, base = await hedged_json(
+        health.order(VIDEO_APIS),
+        f"/api/v1/channels/{c}/videos",
+        {"continuation": continuation} if continuation else None,
+        accept=lambda d: isinstance(d, dict) and isinstance(d.get("videos"), list),
+        budget=LATENCY_BUDGET["channel"],
+    )
+
+    if not data:
+        return None
+
+    searchindex.add(data["videos"], author_id=c)
+
+    return {
+        "videos": [channel_video(v, None, c) for v in data["videos"]],
+        "continuation": data.get("continuation"),
+        "source": base
+    }
+
+# 先頭ページはメモリのフィード（よく見られるチャンネルは裏で新着だけ更新）から、
+# それより古いページは continuation ごとにキャッシュして返す
+@app.get("/api/channel/videos")
+async def api_channel_videos(request: Request, c: str, continuation: str = None):
+    if continuation:
+        result, status = await cache.cached(
+            f"channel-videos:{c}:{continuation}",
+            CACHE_TTL["channel"],
+            lambda: channel_videos_page(c, continuation),
+        )
+        if result is None:
+            raise HTTPException(status_code=503, detail="Channel unavailable")
+        return delivery.json_response(request, result, status)
+
+    feed, hit = await feeds.get(c, channel_videos_page)
+    if feed is None:
+        raise HTTPException(status_code=503, detail="Channel unavailable")
+
+    return delivery.json_response(request, {
+        "videos": feed.videos,
+        "continuation": feed.continuation,
+        "source": feed.base,
+    }, cache.HIT if hit else cache.MISS)
 
 # ===============================
 # Stream（iOS対応・映像＋音声合成）
 # ===============================
 @app.get("/api/stream")
-def api_stream(video_id: str, quality: str = "best"):
-    for base in VIDEO_APIS:
-        data = try_json(f"{base}/api/v1/videos/{video_id}")
-        if not data:
-            continue
+async def api_stream(request: Request, video_id: str, quality: str = "best", mode: str = "stream", lang: str = None):
+    info = await get_video_info(
+        video_id,
+        formats=True,
+        accept=lambda table: all(pick_video_audio(table, quality, lang)),
+    )
+
+    if not info:
+        raise HTTPException(status_code=503, detail="Stream unavailable")
+
+    video, audio = pick_video_audio(info.table, quality, lang)
+    codec_args, path = mux_plan(video, audio)
+
+    # 入力の itag もキーに入れる（copy だと 1080p と 720p で codec_args が同じになり、
+    # 別の中身に同じ強い ETag が付いて If-Range の再開でつなぎ合わされてしまう）
+    profile = ("file " if mode == "file" else "fmp4 ") + " ".join(codec_args)
+    key = muxcache.key(video_id, quality, f"{profile} lang={lang or ''} itags={video.get('itag')},{audio.get('itag')}")
+    etag = muxcache.etag(key)
+    headers = {"X-Mux-Path": path, "ETag": etag}
+
+    # mux 済みがあれば Range / ETag 付きでそのまま返す
+    cached = muxcache.lookup(key)
+    if cached:
+        if delivery.not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
 
-        video_url, audio_url = pick_video_audio(
-            data.get("adaptiveFormats", []),
-            quality
+        return FileResponse(
+            cached,
+            media_type="video/mp4",
+            filename=f"{video_id}.mp4" if mode == "file" else None,
+            headers={**headers, "X-Cache": "hit"},
         )
 
-        if not video_url or not audio_url:
-            continue
+    try:
+        if mode != "file":
+            job = scheduler.submit(
+                key,
+                lambda: stream_video_audio_ios(video["url"], audio["url"], codec_args),
+                fragmented=True,
+            )
+        else:
+            job = scheduler.submit(
+                key,
+                lambda out: mux_video_audio_ios(video["url"], audio["url"], codec_args, out),
+            )
+    except QueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Stream busy",
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
-        output = mux_video_audio_ios(video_url, audio_url)
+    mux.stats[path] += 1
+    headers["X-Cache"] = "miss"
 
-        return FileResponse(
-            output,
-            media_type="video/mp4",
-            filename=f"{video_id}.mp4"
+    # 既定は fragmented MP4 を書かれた端から流す（同じジョブに何人でも相乗りできる）。
+    # mode=file で従来どおり全部書いてから返す
+    if mode != "file":
+        try:
+            body = await scheduler.follow_started(job)
+        except Exception as e:
+            print("mux error:", video_id, e)
+            raise HTTPException(status_code=503, detail="Mux failed")
+
+        return StreamingResponse(body, media_type="video/mp4", headers=headers)
+
+    output = await scheduler.wait(job)
+    if not output:
+        raise HTTPException(status_code=503, detail="Mux failed")
+
+    return FileResponse(
+        output,
+        media_type="video/mp4",
+        filename=f"{video_id}.mp4",
+        headers=headers,
+    )
+
+# ===============================
+# HLS（iOS対応・必要なセグメントだけ合成）
+# ===============================
+@app.get("/api/hls/{video_id}/index.m3u8")
+async def api_hls_playlist(video_id: str, quality: str = "best", lang: str = None):
+    info = await get_video_info(
+        video_id,
+        formats=True,
+        accept=lambda table: all(pick_video_audio(table, quality, lang)),
+    )
+
+    length = info.meta.get("lengthSeconds") if info else None
+    if not isinstance(length, int) or length <= 0:
+        raise HTTPException(status_code=503, detail="Stream unavailable")
+
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{HLS_SEGMENT_SECONDS}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ]
+
+    for n in range(math.ceil(length / HLS_SEGMENT_SECONDS)):
+        duration = min(HLS_SEGMENT_SECONDS, length - n * HLS_SEGMENT_SECONDS)
+        lines.append(f"#EXTINF:{duration:.3f},")
+        lines.append(f"/api/hls/{video_id}/{quality}/{n}.ts" + (f"?lang={lang}" if lang else ""))
+
+    lines.append("#EXT-X-ENDLIST")
+
+    return Response(
+        "\n".join(lines) + "\n",
+        media_type="application/vnd.apple.mpegurl",
+    )
+
+def submit_hls_segment(video_id, quality, lang, n, video, audio):
+    codec_args = segment_args(video)
+    profile = (
+        f"hls {HLS_SEGMENT_SECONDS} {n} lang={lang or ''} itags={video.get('itag')},{audio.get('itag')} "
+        + " ".join(codec_args)
+    )
+    key = muxcache.key(video_id, quality, profile)
+
+    if muxcache.lookup(key, "ts"):
+        return key, None
+
+    start = n * HLS_SEGMENT_SECONDS
+    job = scheduler.submit(
+        key,
+        lambda out: mux_segment(
+            video["url"], audio["url"], start, HLS_SEGMENT_SECONDS, codec_args, out
+        ),
+        ext="ts",
+    )
+    return key, job
+
+@app.get("/api/hls/{video_id}/{quality}/{n}.ts")
+async def api_hls_segment(video_id: str, quality: str, n: int, lang: str = None):
+    info = await get_video_info(
+        video_id,
+        formats=True,
+        accept=lambda table: all(pick_video_audio(table, quality, lang)),
+    )
+
+    if not info:
+        raise HTTPException(status_code=503, detail="Stream unavailable")
+
+    length = info.meta.get("lengthSeconds") or 0
+    if n < 0 or n * HLS_SEGMENT_SECONDS >= length:
+        raise HTTPException(status_code=404, detail="Segment not found")
+
+    video, audio = pick_video_audio(info.table, quality, lang)
+
+    try:
+        key, job = submit_hls_segment(video_id, quality, lang, n, video, audio)
+    except QueueFull as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Stream busy",
+            headers={"Retry-After": str(e.retry_after)},
         )
 
-    raise HTTPException(status_code=503, detail="Stream unavailable")
+    # 空きがあるときだけ数セグメント先を作っておく
+    for ahead in range(n + 1, n + 1 + HLS_PREFETCH):
+        if ahead * HLS_SEGMENT_SECONDS >= length or not scheduler.idle():
+            break
+        submit_hls_segment(video_id, quality, lang, ahead, video, audio)
+
+    path = muxcache.path_for(key, "ts") if job is None else await scheduler.wait(job)
+    if not path:
+        raise HTTPException(status_code=503, detail="Segment failed")
+
+    return FileResponse(path, media_type="video/mp2t")
 
 # ===============================
 # Stream URL ONLY（旧）
 # ===============================
 @app.get("/api/streamurl")
-def api_streamurl(video_id: str, quality: str = "best"):
-    for base in VIDEO_APIS:
-        data = try_json(f"{base}/api/v1/videos/{video_id}")
-        if not data:
-            continue
+async def api_streamurl(
+    request: Request,
+    video_id: str,
+    quality: str = "best",
+    proxy: bool = False,
+    lang: str = None,
+    all_qualities: bool = Query(False, alias="all"),
+):
+    info = await get_video_info(
+        video_id,
+        formats=True,
+        accept=lambda table: all(pick_stream_urls(table, quality, lang)),
+    )
+
+    if not info:
+        raise HTTPException(status_code=503, detail="Stream unavailable")
+
+    return delivery.json_response(request, streamurl_result(video_id, info, quality, proxy, lang, all_qualities))
+
+def streamurl_result(video_id, info, quality="best", proxy=False, lang=None, all_qualities=False):
+    def url_of(f):
+        if not f:
+            return None
+        # proxy=1 ならこちらの /api/proxy 経由の URL を返す（IP 固定の URL 対策）
+        return proxy_url(video_id, f) if proxy else f["url"]
+
+    # all=1 なら全画質をまとめて返す（画質切り替えで取り直さなくていいように）
+    if all_qualities:
+        audio = info.table.audio(lang)
+        return {
+            "qualities": [
+                {
+                    "quality": label,
+                    "height": v["height"],
+                    "fps": v["fps"],
+                    "codec": v["codec"],
+                    "bitrate": v["bitrate"],
+                    "video": url_of(v["format"]),
+                }
+                for label, v in info.table.qualities().items()
+            ],
+            "audio": url_of(audio),
+            "languages": info.table.languages(),
+            "source": info.base
+        }
+
+    return {
+        "video": url_of(info.table.video(quality)),
+        "audio": url_of(info.table.audio(lang)),
+        "source": info.base
+    }
+
+# ===============================
+# Watch（動画情報・ストリーム URL・コメントを 1 本で）
+# ===============================
+# メタデータとストリーム URL は同じ /api/v1/videos を読むので、同時に取れば flights で 1 本にまとまる。
+# メタデータ側はストリームの accept に縛られない（adaptiveFormats が使えない動画でもタイトルは出す）。
+# コメントは並行して取り、できた順に 1 行ずつ NDJSON で流す
+async def watch_parts(video_id, quality, proxy, lang):
+    info_task = asyncio.create_task(get_video_info(
+        video_id,
+        formats=True,
+        accept=lambda table: all(pick_stream_urls(table, quality, lang)),
+    ))
+
+    async def video_part():
+        result, status = await cached_video(video_id)
+        if result is None:
+            return "video", None
+        return "video", {**result, "cache": status}
+
+    async def stream_part():
+        info = await asyncio.shield(info_task)
+        if not info:
+            return "streamurl", None
+        return "streamurl", streamurl_result(video_id, info, quality, proxy, lang, all_qualities=True)
+
+    async def comments_part():
+        result, status = await cached_comments(video_id)
+        if result is None:
+            return "comments", None
+        return "comments", {**result, "cache": status}
+
+    # 例外で落ちた部分も、その type のエラー行として返す（クライアントが待ち続けないように）
+    async def guarded(kind, part):
+        try:
+            return await part()
+        except Exception as e:
+            print("watch part error:", video_id, kind, e)
+            return kind, None
+
+    tasks = [
+        asyncio.create_task(guarded(kind, part))
+        for kind, part in (("video", video_part), ("streamurl", stream_part), ("comments", comments_part))
+    ]
 
-        video_url = None
-        audio_url = None
-
-        for f in data.get("adaptiveFormats", []):
-            if f.get("type", "").startswith("video") and f.get("url"):
-                label = f.get("qualityLabel") or ""
-                if quality == "best" or quality in label:
-                    video_url = f["url"]
-                    break
-
-        for f in data.get("adaptiveFormats", []):
-            if f.get("type", "").startswith("audio") and f.get("url"):
-                lang = (f.get("language") or "").lower()
-                audio_track = str(f.get("audioTrack") or "").lower()
-                if "en" in lang:
-                    continue
-                if "english" in audio_track:
-                    continue
-                audio_url = f["url"]
-                break
-
-        if video_url and audio_url:
-            return {
-                "video": video_url,
-                "audio": audio_url,
-                "source": base
-            }
-
-    raise HTTPException(status_code=503, detail="Stream unavailable")
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            kind, data = await next_done
+            line = {"type": kind, **data} if data else {"type": kind, "error": "unavailable"}
+            yield delivery.dumps(line) + b"\n"
+    finally:
+        for task in tasks + [info_task]:
+            task.cancel()
+
+@app.get("/api/watch")
+async def api_watch(video_id: str, quality: str = "best", proxy: bool = False, lang: str = None):
+    return StreamingResponse(
+        watch_parts(video_id, quality, proxy, lang),
+        media_type="application/x-ndjson",
+    )
 
+# ===============================
+# Proxy（googlevideo を Range 付きで中継・キャッシュ）
+# ===============================
+def proxy_url(video_id, f):
+    return f"/api/proxy?video_id={video_id}&itag={f.get('itag')}"
+
+@app.get("/api/proxy")
+async def api_proxy(request: Request, video_id: str, itag: str):
+    # itag は手元の動画情報から引く。無い itag のために上流を取り直すと、
+    # 全インスタンスに投げたうえ「使えない応答」として健康状態まで下げてしまう
+    info = await get_video_info(video_id, formats=True)
+    if not info:
+        raise HTTPException(status_code=503, detail="Stream unavailable")
+
+    fmt = info.table.format(itag)
+    if not fmt:
+        raise HTTPException(status_code=404, detail="Format not found")
+
+    return await proxy_format(request, video_id, fmt)
+
+# ===============================
+# Instance Health
+# ===============================
+@app.get("/api/instances")
+def api_instances():
+    return {
+        "worker": os.getpid(),
+        "instances": health.snapshot(),
+        "cache": cache.responses.stats(),
+        "singleflight": flights.stats(),
+        "videoinfo": videoinfo.snapshot(),
+        "mux": mux.stats,
+        "muxcache": muxcache.snapshot(),
+        "jobs": scheduler.snapshot(),
+        "proxy": proxycache.snapshot(),
+        "searchindex": searchindex.snapshot(),
+        "suggest": suggest.snapshot(),
+        "feeds": feeds.snapshot(),
+        "shared": shared.snapshot(),
+    }
+
+# ===============================
+# Metrics（Prometheus）
+# ===============================
+@app.get("/metrics")
+def api_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# ===============================
+# ★ 仙人music
+# ===============================
+# /music/search などの API を先に登録してから、残りの /music を静的ファイルにする
+app.include_router(music.router)
+
+if os.path.isdir("statics/music"):
+    app.mount("/music", delivery.CachedStaticFiles(directory="statics/music", html=True), name="music")
+else:
+    print("⚠ statics/music directory not found (skipped mount)")
@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import FileResponse, JSONResponse
+
+# ===============================
+# Fake Invidious（ベンチマーク用）
+# ===============================
+# /api/v1/search・videos・comments・channels の固定ペイロードを返すローカルの代役。
+# 遅延・エラー率・タイムアウト（応答しない）を注入できる。
+# adaptiveFormats の URL は /media/{name}（Range 対応）か、--local-media ならローカルのファイルパス
+#
+#   python bench/fake_invidious.py --port 9001 --latency 0.05 --error-rate 0.1
+MEDIA = {
+    # itag: (ファイル名, type, qualityLabel, 高さ, 言語, ビットレート)
+    "136": ("video.mp4", 'video/mp4; codecs="avc1.4d401f"', "720p", 720, None, 2000000),
+    "248": ("video.webm", 'video/webm; codecs="vp9"', "1080p", 1080, None, 3000000),
+    "140": ("audio.m4a", 'audio/mp4; codecs="mp4a.40.2"', None, None, "ja", 128000),
+    "251": ("audio.webm", 'audio/webm; codecs="opus"', None, None, "ja", 160000),
+}
+
+app = FastAPI()
+config = argparse.Namespace(
+    port=9001, latency=0.0, jitter=0.0, error_rate=0.0, timeout_rate=0.0,
+    media_dir=None, local_media=False, length=12, pages=4,
+)
+stats = {"requests": 0, "errors": 0, "timeouts": 0}
+
+
+@app.middleware("http")
+async def inject_faults(request, call_next):
+    stats["requests"] += 1
+
+    if random.random() < config.timeout_rate:
+        stats["timeouts"] += 1
+        # クライアント側のタイムアウトより長く黙る
+        await asyncio.sleep(300)
+
+    delay = config.latency + random.uniform(0, config.jitter)
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+    if random.random() < config.error_rate and not request.url.path.startswith("/media/"):
+        stats["errors"] += 1
+        return JSONResponse({"error": "injected error"}, status_code=500)
+
+    return await call_next(request)
+
+
+# 一覧の動画は曲として扱われる長さにしておく（/music/search で弾かれないように）
+def video_item(video_id, n=0, length=180):
+    return {
+        "type": "video",
+        "videoId": video_id,
+        "title": f"{video_id} のテスト動画 {n}",
+        "author": f"チャンネル {n % 7}",
+        "authorId": f"UCbench{n % 7:04d}",
+        "viewCount": 1000 * (n + 1),
+        "published": 1700000000 - n * 86400,
+        "publishedText": f"{n} 日前",
+        "lengthSeconds": length,
+    }
+
+
+def media_url(itag, name):
+    if config.local_media:
+        return os.path.join(config.media_dir, name)
+    expire = int(time.time()) + 6 * 3600
+    return f"http://127.0.0.1:{config.port}/media/{name}?expire={expire}&itag={itag}"
+
+
+def adaptive_formats():
+    formats = []
+
+    # --media-dir が無ければ URL だけの format を返す（/api/streamurl などはそれで足りる）
+    for itag, (name, mime, label, height, lang, bitrate) in MEDIA.items():
+        path = os.path.join(config.media_dir or "", name)
+        if config.media_dir and not os.path.exists(path):
+            continue
+
+        f = {
+            "itag": itag,
+            "type": mime,
+            "url": media_url(itag, name),
+            "bitrate": str(bitrate),
+            "clen": str(os.path.getsize(path)) if config.media_dir else str(bitrate * config.length // 8),
+        }
+        if label:
+            f.update(qualityLabel=label, resolution=f"{height}p", fps=30, size=f"{height * 16 // 9}x{height}")
+        if lang:
+            f.update(language=lang, audioTrack={"id": f"{lang}.0", "displayName": lang})
+        formats.append(f)
+
+    return formats
+
+
+@app.get("/api/v1/stats")
+def api_stats():
+    return {"software": {"name": "fake-invidious"}, **stats}
+
+
+@app.get("/api/v1/search")
+def api_search(q: str, page: int = 1):
+    return [video_item(f"{q[:4]}{page:03d}{i:04d}"[:11], i) for i in range(20)]
+
+
+@app.get("/api/v1/videos/{video_id}")
+def api_video(video_id: str):
+    return {
+        **video_item(video_id, length=config.length),
+        "description": "ベンチマーク用の説明文\n" * 10,
+        "videoThumbnails": [],
+        "adaptiveFormats": adaptive_formats(),
+        "formatStreams": [],
+    }
+
+
+@app.get("/api/v1/comments/{video_id}")
+def api_comments(video_id: str, continuation: str = None):
+    n = int(continuation or 0)
+    return {
+        "comments": [
+            {"author": f"user{i}", "content": f"コメント {n}-{i}", "commentId": f"{video_id}-{n}-{i}"}
+            for i in range(20)
+        ],
+        "continuation": str(n + 1) if n + 1 < config.pages else None,
+    }
+
+
+@app.get("/api/v1/channels/{channel_id}")
+def api_channel(channel_id: str):
+    return {
+        "author": f"チャンネル {channel_id}",
+        "authorId": channel_id,
+        "authorThumbnails": [],
+        "description": "",
+        "subCount": 1000,
+        "viewCount": 100000,
+        "videoCount": 30 * config.pages,
+        "joined": 1500000000,
+        "latestVideos": [video_item(f"{channel_id[:4]}{i:07d}", i) for i in range(30)],
+        "relatedChannels": [],
+    }
+
+
+@app.get("/api/v1/channels/{channel_id}/videos")
+def api_channel_videos(channel_id: str, continuation: str = None):
+    n = int(continuation or 0)
+    return {
+        "videos": [video_item(f"{channel_id[:4]}{n * 30 + i:07d}", n * 30 + i) for i in range(30)],
+        "continuation": str(n + 1) if n + 1 < config.pages else None,
+    }
+
+
+@app.get("/media/{name}")
+def media(name: str):
+    path = os.path.join(config.media_dir or "", os.path.basename(name))
+    if not config.media_dir or not os.path.exists(path):
+        raise HTTPException(status_code=404)
+    return FileResponse(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Invidious instance for benchmarks")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency, 0..jitter seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of API calls answered with 500")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="fraction of calls that never answer")
+    parser.add_argument("--media-dir", help="directory with video.mp4 / video.webm / audio.m4a / audio.webm")
+    parser.add_argument("--local-media", action="store_true", help="return file paths instead of /media URLs")
+    parser.add_argument("--length", type=int, default=12, help="lengthSeconds of every video")
+    parser.add_argument("--pages", type=int, default=4, help="continuation pages for comments / channel videos")
+    parser.parse_args(namespace=config)
+
+    uvicorn.run(app, host="127.0.0.1", port=config.port, log_level="error")
+
+
+if __name__ == "__main__":
+    main()
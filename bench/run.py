@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+# ===============================
+# Benchmark / Load Test
+# ===============================
+# 偽 Invidious（bench/fake_invidious.py）を何台か立て、VIDEO_APIS / COMMENTS_APIS をそこに向けた
+# app.py を uvicorn で起動して、各エンドポイントを指定の同時数で叩く。
+# エンドポイントごとにスループットと p50 / p95 / p99 を出す
+#
+#   python bench/run.py                         # 全インスタンス健康
+#   python bench/run.py --scenario failing      # エラー・タイムアウト・停止中のインスタンス混在
+#   python bench/run.py --mux --local-media     # ffmpeg だけ（ネットワークなし）
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE = os.path.join(ROOT, "bench", "fake_invidious.py")
+
+# 偽インスタンスの設定。None は誰も待ち受けていないポート（落ちているインスタンス）
+SCENARIOS = {
+    "healthy": [
+        {"latency": 0.05, "jitter": 0.05},
+        {"latency": 0.05, "jitter": 0.05},
+        {"latency": 0.1, "jitter": 0.1},
+    ],
+    "failing": [
+        {"latency": 0.05, "jitter": 0.05},
+        {"latency": 0.05, "jitter": 0.05, "error-rate": 0.5},
+        {"latency": 0.05, "timeout-rate": 0.3},
+        None,
+    ],
+    "slow": [
+        {"latency": 0.8, "jitter": 0.4},
+        {"latency": 1.5, "jitter": 1.0},
+        {"latency": 0.3, "jitter": 2.0},
+    ],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_media(directory, length):
+    # lavfi のテスト映像・音声から各 format を作る。作れなかったものは使わない
+    outputs = {
+        "video.mp4": ["-f", "lavfi", "-i", f"testsrc=size=1280x720:rate=30:duration={length}",
+                      "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-g", "60"],
+        "video.webm": ["-f", "lavfi", "-i", f"testsrc=size=1920x1080:rate=30:duration={length}",
+                       "-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-b:v", "1M"],
+        "audio.m4a": ["-f", "lavfi", "-i", f"sine=frequency=440:duration={length}", "-c:a", "aac"],
+        "audio.webm": ["-f", "lavfi", "-i", f"sine=frequency=440:duration={length}", "-c:a", "libopus"],
+    }
+
+    for name, args in outputs.items():
+        path = os.path.join(directory, name)
+        result = subprocess.run(
+            ["ffmpeg", "-y", "-loglevel", "error", *args, path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if result.returncode != 0:
+            print(f"⚠ could not create {name} (skipped)")
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def start_fakes(specs, media_dir, args):
+    procs = []
+    bases = []
+
+    for spec in specs:
+        port = free_port()
+        bases.append(f"http://127.0.0.1:{port}")
+        if spec is None:
+            continue
+
+        cmd = [sys.executable, FAKE, "--port", str(port), "--length", str(args.length)]
+        for k, v in spec.items():
+            cmd += [f"--{k}", str(v)]
+        if media_dir:
+            cmd += ["--media-dir", media_dir]
+        if args.local_media:
+            cmd.append("--local-media")
+
+        procs.append(subprocess.Popen(cmd))
+
+    return procs, bases
+
+
+def start_app(bases, workdir, port):
+    env = {
+        **os.environ,
+        "VIDEO_APIS": ",".join(bases),
+        "COMMENTS_APIS": ",".join(bases),
+        "MUX_CACHE_DIR": os.path.join(workdir, "mux"),
+        "PROXY_CACHE_DIR": os.path.join(workdir, "proxy"),
+        "SEARCH_INDEX_PATH": os.path.join(workdir, "index.db"),
+        "SHARED_PATH": os.path.join(workdir, "shared.db"),
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+
+
+async def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                r = await client.get(url)
+                if r.status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+# ===============================
+# シナリオ
+# ===============================
+# keys 個の ID を使い回すので、同じ ID が何度も来る（キャッシュのヒットも混ざる）。
+# 各関数はパスか、GET 以外なら (method, path, json) を返す
+def endpoints(keys, mux, local_media):
+    def vid():
+        return f"bv{random.randrange(keys):09d}"
+
+    def channel():
+        return f"UCbench{random.randrange(keys):04d}"
+
+    def query():
+        return f"bench{random.randrange(keys)}"
+
+    # 偽インスタンスの continuation は "1", "2", ...（--pages 既定の 4 ページ分）
+    def continuation():
+        return str(random.randrange(1, 4))
+
+    def static_page():
+        return random.choice(["/", "/static/index.html", "/static/watch.html", "/static/channel.html", "/music/"])
+
+    api = {
+        "search": lambda: f"/api/search?q={query()}",
+        "search-federated": lambda: f"/api/search?q={query()}&federated=1",
+        "search-local": lambda: f"/api/search?q={query()}&local=1",
+        "suggest": lambda: "/api/suggest?q=ben",
+        "video": lambda: f"/api/video?video_id={vid()}",
+        "videos-batch": lambda: "/api/videos?ids=" + ",".join(vid() for _ in range(10)),
+        "videos-batch-post": lambda: ("POST", "/api/videos", {"ids": [vid() for _ in range(10)]}),
+        "comments": lambda: f"/api/comments?video_id={vid()}",
+        "comments-next": lambda: f"/api/comments?video_id={vid()}&continuation={continuation()}",
+        "comments-stream": lambda: f"/api/comments?video_id={vid()}&stream=1",
+        "channel": lambda: f"/api/channel?c={channel()}",
+        "channel-videos": lambda: f"/api/channel/videos?c={channel()}",
+        "channel-videos-next": lambda: f"/api/channel/videos?c={channel()}&continuation={continuation()}",
+        "streamurl": lambda: f"/api/streamurl?video_id={vid()}&all=1",
+        "streamurl-proxy": lambda: f"/api/streamurl?video_id={vid()}&proxy=1",
+        "hls-playlist": lambda: f"/api/hls/{vid()}/index.m3u8",
+        "watch": lambda: f"/api/watch?video_id={vid()}",
+        "music-search": lambda: f"/music/search?q={query()}",
+        "instances": lambda: "/api/instances",
+        "metrics": lambda: "/metrics",
+        # 圧縮と Cache-Control の効き具合（aiter_raw なので圧縮されたままのバイト数を読む）
+        "static": static_page,
+    }
+
+    if not mux:
+        return api
+
+    media = {
+        "stream-file": lambda: f"/api/stream?video_id={vid()}&mode=file",
+        "stream-fmp4": lambda: f"/api/stream?video_id={vid()}",
+        "hls-segment": lambda: f"/api/hls/{vid()}/best/0.ts",
+    }
+    if not local_media:
+        # googlevideo の代わりに偽インスタンスの /media を中継する
+        media["proxy"] = lambda: f"/api/proxy?video_id={vid()}&itag=140"
+        media["music-stream"] = lambda: f"/music/stream?video_id={vid()}"
+
+    # --local-media では上流 API も叩くが、測りたいのは ffmpeg なので media だけにする
+    return media if local_media else {**api, **media}
+
+
+async def drive(client, path_of, requests, concurrency):
+    latencies = []
+    statuses = {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            request = path_of()
+            method, path, body = ("GET", request, None) if isinstance(request, str) else request
+            start = time.monotonic()
+            try:
+                async with client.stream(method, path, json=body) as r:
+                    async for _ in r.aiter_raw():
+                        pass
+                status = r.status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.monotonic() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.monotonic() - start
+
+    return latencies, statuses, wall
+
+
+def percentile(samples, p):
+    if not samples:
+        return 0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+async def run(app_url, args):
+    rows = []
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=app_url, timeout=timeout, limits=limits) as client:
+        for name, path_of in endpoints(args.keys, args.mux, args.local_media).items():
+            if args.only and name not in args.only:
+                continue
+
+            latencies, statuses, wall = await drive(client, path_of, args.requests, args.concurrency)
+            ok = sum(n for s, n in statuses.items() if s == 200)
+            rows.append((
+                name,
+                f"{len(latencies) / wall:.1f}",
+                f"{percentile(latencies, 0.50) * 1000:.1f}",
+                f"{percentile(latencies, 0.95) * 1000:.1f}",
+                f"{percentile(latencies, 0.99) * 1000:.1f}",
+                f"{ok}/{len(latencies)}",
+                " ".join(f"{s}:{n}" for s, n in sorted(statuses.items(), key=str) if s != 200),
+            ))
+            print(*rows[-1], sep="\t", flush=True)
+
+    return rows
+
+
+def print_table(rows):
+    header = ("endpoint", "req/s", "p50 ms", "p95 ms", "p99 ms", "ok", "other")
+    widths = [max(len(str(r[i])) for r in [header, *rows]) for i in range(len(header))]
+    print()
+    for r in [header, *rows]:
+        print("  ".join(str(v).ljust(w) for v, w in zip(r, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app.py against local fake Invidious instances")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="healthy")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--keys", type=int, default=50, help="distinct video / channel / query ids")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--only", nargs="*", help="endpoint names to run")
+    parser.add_argument("--mux", action="store_true", help="also run stream / HLS / proxy endpoints (needs ffmpeg)")
+    parser.add_argument("--local-media", action="store_true",
+                        help="formats point at local files: measures ffmpeg without network access")
+    parser.add_argument("--length", type=int, default=12, help="seconds of generated test media")
+    parser.add_argument("--app-url", help="benchmark an already running server instead of starting one")
+    args = parser.parse_args()
+
+    if args.local_media:
+        args.mux = True
+
+    workdir = tempfile.mkdtemp(prefix="sennin-bench-")
+    procs = []
+
+    try:
+        media_dir = None
+        if args.mux:
+            media_dir = os.path.join(workdir, "media")
+            os.makedirs(media_dir)
+            make_media(media_dir, args.length)
+
+        app_url = args.app_url
+        if not app_url:
+            fakes, bases = start_fakes(SCENARIOS[args.scenario], media_dir, args)
+            procs += fakes
+            port = free_port()
+            procs.append(start_app(bases, workdir, port))
+            app_url = f"http://127.0.0.1:{port}"
+            asyncio.run(wait_ready(app_url + "/api/instances"))
+            print(f"scenario={args.scenario} instances={len(bases)} app={app_url}")
+
+        print(f"concurrency={args.concurrency} requests={args.requests} keys={args.keys}")
+        rows = asyncio.run(run(app_url, args))
+        print_table(rows)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
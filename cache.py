@@ -0,0 +1,178 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import metrics
+import shared
+
+# ===============================
+# Response Cache（TTL + LRU + stale-while-revalidate）
+# ===============================
+MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "2000"))
+
+# 期限切れからこの秒数までは stale を即返しつつ裏で更新する。
+# それより古いものは上流が全滅したときの予備としてだけ使う
+STALE_SECONDS = int(os.environ.get("CACHE_STALE_SECONDS", "86400"))
+
+# negative=True のキーは、取れなかった（空だった）ことをこの秒数だけ覚えておく。
+# その間は上流に行かずに (None, HIT) を返す（最後のページの次などを何度も取りに行かないように）
+NEGATIVE_TTL = int(os.environ.get("CACHE_NEGATIVE_TTL", "30"))
+
+HIT = "hit"
+MISS = "miss"
+STALE = "stale"
+STALE_IF_ERROR = "stale-if-error"
+
+
+class TTLCache:
+    def __init__(self, maxsize=MAX_ENTRIES):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def set(self, key, value, ttl):
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "entries": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+        }
+
+
+responses = TTLCache()
+
+_refreshing = {}
+
+
+# メモリと共有ストア（他のワーカー）の両方に入れる。共有側は stale の間も残す（取れなかった記録は TTL の間だけ）
+def _store(key, value, ttl):
+    responses.set(key, value, ttl)
+    shared.put(
+        "cache", key, {"value": value, "expires": time.time() + ttl},
+        ttl + STALE_SECONDS if value is not None else ttl,
+    )
+
+
+# 取れなかったことを覚える。stale でも使える値を持っているならそちらを残す
+def _store_negative(key):
+    entry = responses._data.get(key)
+    if entry is None or entry[0] is None:
+        _store(key, None, NEGATIVE_TTL)
+
+
+# メモリに無いか期限切れのときだけ共有ストアを見る。entry より新しければメモリにも入れて返す
+def _load(key, entry):
+    stored = shared.get("cache", key)
+    if stored is None:
+        return entry
+
+    loaded = (stored["value"], time.monotonic() + stored["expires"] - time.time())
+    if entry is not None and entry[1] >= loaded[1]:
+        return entry
+
+    responses.set(key, loaded[0], stored["expires"] - time.time())
+    return loaded
+
+
+async def _refresh(key, ttl, fetch, negative=False):
+    try:
+        value = await fetch()
+        if value is not None:
+            _store(key, value, ttl)
+        elif negative:
+            _store_negative(key)
+    except Exception as e:
+        print("cache refresh error:", key, e)
+    finally:
+        _refreshing.pop(key, None)
+
+
+# fetch は上流から取り直す coroutine 関数。失敗時は None を返すこと。
+# 戻り値は (value, cache status)。取れなかったら (None, MISS)。
+# negative=True なら取れなかったことも NEGATIVE_TTL だけ覚え、その間は (None, HIT) を返す
+async def cached(key, ttl, fetch, negative=False):
+    entry = responses.get(key)
+    now = time.monotonic()
+
+    if entry is None or now >= entry[1]:
+        entry = _load(key, entry)
+
+    # 期限切れの「取れなかった」記録は無いのと同じ
+    if entry is not None and entry[0] is None and now >= entry[1]:
+        entry = None
+
+    if entry is not None:
+        value, expires = entry
+
+        if now < expires:
+            responses.hits += 1
+            return _count(key, value, HIT)
+
+        if now < expires + STALE_SECONDS:
+            responses.stale += 1
+            if key not in _refreshing:
+                _refreshing[key] = asyncio.create_task(_refresh(key, ttl, fetch, negative))
+            return _count(key, value, STALE)
+
+    # 先読み中ならそれを待って使う
+    if key in _refreshing:
+        await asyncio.shield(_refreshing[key])
+        fresh = responses.get(key)
+        if fresh is not None and time.monotonic() < fresh[1]:
+            responses.hits += 1
+            return _count(key, fresh[0], HIT)
+
+    responses.misses += 1
+    value = await fetch()
+
+    if value is not None:
+        _store(key, value, ttl)
+        return _count(key, value, MISS)
+
+    if entry is not None:
+        return _count(key, entry[0], STALE_IF_ERROR)
+
+    if negative:
+        _store_negative(key)
+
+    return _count(key, None, MISS)
+
+
+# "video:xxx" → kind "video" ごとにヒット / ミスを数える
+def _count(key, value, status):
+    metrics.cache_lookups.inc(key.split(":")[0], status if value is not None else "error")
+    return value, status
+
+
+# まだ持っていない（か期限切れの）キーを裏で取っておく
+def prefetch(key, ttl, fetch, negative=False):
+    entry = responses._data.get(key)
+    if entry is None or time.monotonic() >= entry[1]:
+        entry = _load(key, entry)
+    if entry is not None and time.monotonic() < entry[1]:
+        return
+    if key not in _refreshing:
+        _refreshing[key] = asyncio.create_task(_refresh(key, ttl, fetch, negative))
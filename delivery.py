@@ -0,0 +1,179 @@
+import gzip
+import hashlib
+import json
+import os
+
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import MutableHeaders
+
+# ===============================
+# Response Pipeline
+# ===============================
+# JSON は orjson があればそれで直接 bytes にする。上流由来の API 応答には本文から強い ETag を付けて
+# If-None-Match なら 304、一定サイズ以上は br / gzip で圧縮、静的ページには長めの Cache-Control
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# 静的ページ（statics/*.html など）のキャッシュ秒数。ETag で再検証できるので長めでいい
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", "86400"))
+
+COMPRESSIBLE = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/x-ndjson",
+    "application/vnd.apple.mpegurl",
+    "image/svg+xml",
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return dumps(content)
+
+
+def etag_of(body):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _etags(header):
+    # 圧縮した応答には弱い ETag（W/"..."）を付けるので、比較は W/ を外して行う
+    return {tag.strip().removeprefix("W/") for tag in (header or "").split(",") if tag.strip()}
+
+
+# If-None-Match（リスト・W/ 付きも）が etag に当たるか。"*" は何にでも当たる
+def not_modified(request, etag):
+    tags = _etags(request.headers.get("if-none-match"))
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+# 上流から取ってキャッシュしている dict をそのまま返すときに使う。
+# cache（hit / miss / stale ...）は本文ではなく X-Cache ヘッダに入れる（ETag が変わらないように）
+def json_response(request, data, cache_status=None):
+    body = dumps(data)
+    etag = etag_of(body)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if cache_status:
+        headers["X-Cache"] = cache_status
+
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    return Response(body, media_type="application/json", headers=headers)
+
+
+# ===============================
+# Compression
+# ===============================
+def negotiate(accept_encoding):
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+# 本文が 1 回で来る（ストリーミングでない）応答だけを圧縮する ASGI ミドルウェア。
+# 動画・音声・Range 応答・ストリーミング応答は触らない
+class Compression:
+    def __init__(self, app, minimum_size=COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        encoding = negotiate(accept)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+
+            if message["type"] == "http.response.start":
+                start = message
+                return
+
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+
+            pending, start = start, None
+            headers = MutableHeaders(raw=pending["headers"])
+            body = message.get("body", b"")
+
+            if message.get("more_body") or not self.eligible(headers, body):
+                await send(pending)
+                await send(message)
+                return
+
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag
+
+            await send(pending)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+    def eligible(self, headers, body):
+        content_type = headers.get("content-type", "")
+        return (
+            len(body) >= self.minimum_size
+            and "content-encoding" not in headers
+            and "content-range" not in headers
+            and content_type.startswith(COMPRESSIBLE)
+        )
+
+
+# ===============================
+# Static
+# ===============================
+class CachedStaticFiles(StaticFiles):
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers.setdefault("Cache-Control", f"public, max-age={STATIC_MAX_AGE}")
+        return response
@@ -0,0 +1,128 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+# ===============================
+# Channel Feed Store
+# ===============================
+# チャンネルの新着動画一覧（/api/v1/channels/{id}/videos の先頭ページ）をメモリに持つ。
+# よく見られるチャンネルは裏で先頭ページだけ取り直し、前回の先頭より新しい動画だけを前に足す。
+# 古いページは continuation で必要になったときに取る
+MAX_CHANNELS = int(os.environ.get("FEED_MAX_CHANNELS", "200"))
+FEED_TTL = int(os.environ.get("FEED_TTL", "1800"))
+
+REFRESH_INTERVAL = float(os.environ.get("FEED_REFRESH_INTERVAL", "300"))
+REFRESH_CHANNELS = int(os.environ.get("FEED_REFRESH_CHANNELS", "20"))
+# この回数以上見られたチャンネルだけ裏で更新する
+REFRESH_MIN_VIEWS = 2
+
+# 新着を足していってこれを超えたら先頭ページから作り直す
+MAX_FEED_VIDEOS = 200
+
+
+class ChannelFeed:
+    def __init__(self, channel_id, page):
+        self.channel_id = channel_id
+        self.views = 0
+        self.reset(page)
+
+    # page は {"videos": [...], "continuation": ..., "source": ...}
+    def reset(self, page):
+        self.videos = list(page["videos"])
+        self.continuation = page.get("continuation")
+        self.base = page.get("source")
+        self.refreshed = time.time()
+
+    # 取り直した先頭ページのうち、今の先頭より新しいものだけ前に足す。足した数を返す
+    def merge(self, page):
+        # 空のページは取れなかったのと同じ扱い（丸ごと新しいと見なして消さない）
+        if not page["videos"]:
+            return 0
+
+        known = {v["videoId"] for v in self.videos}
+        new = []
+        for v in page["videos"]:
+            if v["videoId"] in known:
+                break
+            new.append(v)
+
+        # 1 ページ丸ごと新しい（間が抜けている）か大きくなりすぎたら作り直す
+        if len(new) == len(page["videos"]) or len(new) + len(self.videos) > MAX_FEED_VIDEOS:
+            self.reset(page)
+            return len(new)
+
+        self.videos[:0] = new
+        self.base = page.get("source")
+        self.refreshed = time.time()
+        return len(new)
+
+    def fresh(self, now):
+        return now < self.refreshed + FEED_TTL
+
+
+_feeds = OrderedDict()
+stats = {"hits": 0, "misses": 0, "refreshed": 0, "newVideos": 0}
+
+
+# fetch(channel_id) は先頭ページを返す coroutine 関数。失敗時は None
+async def get(channel_id, fetch):
+    feed = _feeds.get(channel_id)
+    now = time.time()
+
+    if feed is not None:
+        _feeds.move_to_end(channel_id)
+        feed.views += 1
+
+        if feed.fresh(now):
+            stats["hits"] += 1
+            return feed, True
+
+    stats["misses"] += 1
+    page = await fetch(channel_id)
+
+    if not page:
+        # 取れなければ古くても持っている方を返す
+        return feed, feed is not None
+
+    if feed is None:
+        feed = ChannelFeed(channel_id, page)
+        feed.views = 1
+        _feeds[channel_id] = feed
+        while len(_feeds) > MAX_CHANNELS:
+            _feeds.popitem(last=False)
+    else:
+        stats["newVideos"] += feed.merge(page)
+
+    return feed, False
+
+
+async def refresh(fetch):
+    hot = sorted(
+        (f for f in _feeds.values() if f.views >= REFRESH_MIN_VIEWS),
+        key=lambda f: f.views,
+        reverse=True,
+    )[:REFRESH_CHANNELS]
+
+    for feed in hot:
+        page = await fetch(feed.channel_id)
+        if page:
+            stats["newVideos"] += feed.merge(page)
+            stats["refreshed"] += 1
+
+    # 閲覧数は毎回半分にして、最近見られているチャンネルを優先する
+    for feed in _feeds.values():
+        feed.views //= 2
+
+
+async def refresh_loop(fetch, interval=REFRESH_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await refresh(fetch)
+        except Exception as e:
+            print("feed refresh error:", e)
+
+
+def snapshot():
+    return {"channels": len(_feeds), "maxChannels": MAX_CHANNELS, **stats}
@@ -0,0 +1,174 @@
+import os
+import re
+
+from mux import format_height, is_ios_audio, is_ios_video
+
+# ===============================
+# Format Table
+# ===============================
+# adaptiveFormats を一度だけ解析して、高さ・fps・コーデック・ビットレート・音声言語で引けるようにする
+
+
+# "en-US.10" / "ja_JP" / "JA" → "en" / "ja"。地域や音声トラック番号は見ずに主言語だけで比べる
+def primary_lang(lang):
+    return re.split(r"[.\-_]", (lang or "").strip())[0].lower()
+
+
+# 言語指定がないときに避ける音声言語（カンマ区切り）。全部避けた結果なにも残らなければ制限なし
+AUDIO_EXCLUDE_LANGS = [
+    primary_lang(lang)
+    for lang in os.environ.get("AUDIO_EXCLUDE_LANGS", "en").split(",")
+    if lang.strip()
+]
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _codec(f):
+    m = re.search(r'codecs="([^".]+)', f.get("type") or "")
+    return m.group(1) if m else ""
+
+
+def _fps(f):
+    fps = _int(f.get("fps"))
+    if fps:
+        return fps
+    m = re.search(r"p(\d+)", f.get("qualityLabel") or "")
+    return int(m.group(1)) if m else 30
+
+
+def _lang(f):
+    lang = f.get("language")
+    if not lang:
+        track = f.get("audioTrack")
+        if isinstance(track, dict):
+            lang = track.get("id")
+        elif track:
+            lang = str(track)
+    # 音声トラックが表示名のまま来ることがある（"English original" など）
+    if lang and "english" in lang.lower():
+        return "en"
+    return primary_lang(lang)
+
+
+def quality_label(height, fps):
+    return f"{height}p{fps}" if fps > 30 else f"{height}p"
+
+
+# "best" / "720" / "720p" / "720p60" → (height, fps)。best は (None, None)
+def parse_quality(quality):
+    m = re.match(r"^(\d+)p?(\d+)?$", (quality or "").strip().lower())
+    if not m:
+        return None, None
+    return int(m.group(1)), int(m.group(2)) if m.group(2) else None
+
+
+class FormatTable:
+    def __init__(self, formats):
+        self.videos = []
+        self.audios = []
+
+        for f in formats or []:
+            if not isinstance(f, dict) or not f.get("url"):
+                continue
+
+            kind = (f.get("type") or "").split("/")[0]
+
+            if kind == "video":
+                self.videos.append({
+                    "format": f,
+                    "itag": str(f.get("itag")),
+                    "height": format_height(f) or 0,
+                    "fps": _fps(f),
+                    "codec": _codec(f),
+                    "bitrate": _int(f.get("bitrate")),
+                    "ios": is_ios_video(f),
+                })
+            elif kind == "audio":
+                self.audios.append({
+                    "format": f,
+                    "itag": str(f.get("itag")),
+                    "codec": _codec(f),
+                    "bitrate": _int(f.get("bitrate")),
+                    "lang": _lang(f),
+                    "ios": is_ios_audio(f),
+                })
+
+        self.videos.sort(key=lambda v: (v["height"], v["fps"], v["bitrate"]), reverse=True)
+        self.audios.sort(key=lambda a: a["bitrate"], reverse=True)
+
+        self.by_height = {}
+        for v in self.videos:
+            self.by_height.setdefault(v["height"], []).append(v)
+
+        self.by_itag = {r["itag"]: r["format"] for r in self.videos + self.audios}
+
+    def __bool__(self):
+        return bool(self.videos or self.audios)
+
+    # 画質ラベル（"1080p60" など）ごとに一番ビットレートの高い映像。高画質順
+    def qualities(self):
+        qualities = {}
+        for v in self.videos:
+            qualities.setdefault(quality_label(v["height"], v["fps"]), v)
+        return qualities
+
+    # 指定の高さがなければ、それ以下で一番近い高さ（なければ一番低い高さ）にする。
+    # fps 指定がなければ 30fps 以下を優先
+    def video(self, quality="best", prefer_ios=False):
+        if not self.videos:
+            return None
+
+        height, fps = parse_quality(quality)
+
+        # best で iOS 優先なら、高さより avc1 であることを優先する
+        if height is None and prefer_ios:
+            ios = [v for v in self.videos if v["ios"]]
+            if ios:
+                return ios[0]["format"]
+
+        if height is None:
+            candidates = self.by_height[self.videos[0]["height"]]
+        else:
+            heights = sorted(self.by_height, reverse=True)
+            target = next((h for h in heights if h <= height), heights[-1])
+            candidates = self.by_height[target]
+
+        if fps is not None:
+            candidates = [v for v in candidates if v["fps"] == fps] or candidates
+        elif height is not None:
+            candidates = [v for v in candidates if v["fps"] <= 30] or candidates
+
+        if prefer_ios:
+            candidates = [v for v in candidates if v["ios"]] or candidates
+
+        return candidates[0]["format"]
+
+    # lang 指定があればその言語を優先、なければ AUDIO_EXCLUDE_LANGS 以外を優先
+    def audio(self, lang=None, prefer_ios=False):
+        if not self.audios:
+            return None
+
+        if lang:
+            lang = primary_lang(lang)
+            candidates = [a for a in self.audios if a["lang"] == lang]
+        else:
+            candidates = [a for a in self.audios if a["lang"] not in AUDIO_EXCLUDE_LANGS]
+
+        candidates = candidates or self.audios
+
+        if prefer_ios:
+            candidates = [a for a in candidates if a["ios"]] or candidates
+
+        return candidates[0]["format"]
+
+    def format(self, itag):
+        return self.by_itag.get(str(itag))
+
+    def languages(self):
+        return sorted({a["lang"] for a in self.audios if a["lang"]})
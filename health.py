@@ -0,0 +1,255 @@
+import os
+import random
+import time
+
+import shared
+
+# ===============================
+# Instance Health
+# ===============================
+# インスタンスごとに EWMA レイテンシ・エラー率・「200 だが使えない」率を持ち、
+# 連続失敗でサーキットを開いて一定時間候補から外す
+EWMA_ALPHA = 0.2
+DEFAULT_LATENCY = 1.0
+
+FAILURE_THRESHOLD = int(os.environ.get("HEALTH_FAILURE_THRESHOLD", "3"))
+OPEN_SECONDS = float(os.environ.get("HEALTH_OPEN_SECONDS", "30"))
+OPEN_SECONDS_MAX = 300
+
+# 0 ならバックグラウンドのプローブはしない
+PROBE_INTERVAL = float(os.environ.get("HEALTH_PROBE_INTERVAL", "0"))
+
+# 他のワーカーの記録を取り込む間隔と、自分の記録（EWMA など）を書き出す間隔（秒）。
+# サーキットの開閉はその場で書き出す
+SYNC_INTERVAL = float(os.environ.get("HEALTH_SYNC_INTERVAL", "1"))
+SHARED_TTL = 3600
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class InstanceHealth:
+    def __init__(self, base):
+        self.base = base
+        self.latency = None
+        self.error_rate = 0.0
+        self.unusable_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.unusable = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.open_seconds = OPEN_SECONDS
+        self.changed_at = 0.0
+        self.published = 0.0
+        self.published_state = CLOSED
+
+    def available(self, now):
+        if self.state == CLOSED:
+            return True
+        # half-open は試行中なので他のリクエストには回さない
+        if self.state == HALF_OPEN:
+            return False
+        return now >= self.open_until
+
+    def weight(self):
+        latency = self.latency if self.latency is not None else DEFAULT_LATENCY
+        ok = (1 - self.error_rate) * (1 - self.unusable_rate)
+        return max(ok, 0.01) / max(latency, 0.05)
+
+    def snapshot(self):
+        return {
+            "base": self.base,
+            "state": self.state,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "errorRate": round(self.error_rate, 3),
+            "unusableRate": round(self.unusable_rate, 3),
+            "requests": self.requests,
+            "errors": self.errors,
+            "unusable": self.unusable,
+            "openFor": max(round(self.open_until - time.monotonic(), 1), 0) if self.state != CLOSED else 0,
+        }
+
+
+_instances = {}
+_synced = 0.0
+_synced_at = 0.0
+
+
+def get(base):
+    h = _instances.get(base)
+    if h is None:
+        h = _instances[base] = InstanceHealth(base)
+    return h
+
+
+def _ewma(old, value):
+    return value if old is None else old + EWMA_ALPHA * (value - old)
+
+
+def begin(base):
+    h = get(base)
+    if h.state == OPEN and time.monotonic() >= h.open_until:
+        h.state = HALF_OPEN
+
+
+def record_success(base, latency):
+    h = get(base)
+    h.requests += 1
+    h.latency = _ewma(h.latency, latency)
+    h.error_rate = _ewma(h.error_rate, 0.0)
+    h.unusable_rate = _ewma(h.unusable_rate, 0.0)
+    h.consecutive_failures = 0
+    h.state = CLOSED
+    h.open_seconds = OPEN_SECONDS
+    _publish(h)
+
+
+# エラーを返したが応答はした場合。到達できているのでサーキットには数えない（連続失敗は切る）。
+# 5xx（bot 判定で全部 500 を返すなど）はエラー率には入れて重みを下げる。
+# 本当に存在しない動画なら全インスタンスで同じだけ上がるので、相対的な重みは崩れない
+def record_rejected(base, latency, error=False):
+    h = get(base)
+    h.requests += 1
+    h.latency = _ewma(h.latency, latency)
+    h.error_rate = _ewma(h.error_rate, 1.0 if error else 0.0)
+    if error:
+        h.errors += 1
+    h.consecutive_failures = 0
+    if h.state == HALF_OPEN:
+        h.state = CLOSED
+        h.open_seconds = OPEN_SECONDS
+    _publish(h)
+
+
+def record_failure(base):
+    h = get(base)
+    h.requests += 1
+    h.errors += 1
+    h.error_rate = _ewma(h.error_rate, 1.0)
+    h.consecutive_failures += 1
+
+    if h.state == HALF_OPEN:
+        # 試行に失敗したらクールダウンを倍にして開き直す
+        h.open_seconds = min(h.open_seconds * 2, OPEN_SECONDS_MAX)
+        _open(h)
+    elif h.state == CLOSED and h.consecutive_failures >= FAILURE_THRESHOLD:
+        _open(h)
+    _publish(h)
+
+
+# ヘッジで負けてキャンセルされた場合。経過時間は下限値としてレイテンシに反映し、
+# half-open の試行だったら次のリクエストでもう一度試せるよう戻す
+def abort(base, elapsed):
+    h = get(base)
+    if h.latency is None or elapsed > h.latency:
+        h.latency = _ewma(h.latency, elapsed)
+    if h.state == HALF_OPEN:
+        h.state = OPEN
+    _publish(h)
+
+
+def record_unusable(base):
+    h = get(base)
+    h.unusable += 1
+    h.unusable_rate = _ewma(h.unusable_rate, 1.0)
+    _publish(h)
+
+
+def _open(h):
+    h.state = OPEN
+    h.open_until = time.monotonic() + h.open_seconds
+    print(f"circuit open: {h.base} ({h.open_seconds:.0f}s)")
+
+
+# 重み付きランダムで並べた新しいリストを返す（元のリストは変更しない）。
+# サーキットが開いているインスタンスは、全滅しているときだけ返す
+def order(bases):
+    _sync()
+    now = time.monotonic()
+    available = []
+    blocked = []
+
+    for base in bases:
+        h = get(base)
+        if h.available(now):
+            available.append(h)
+        else:
+            blocked.append(h)
+
+    # Efraimidis–Spirakis の重み付きサンプリング
+    available.sort(key=lambda h: random.random() ** (1 / h.weight()), reverse=True)
+
+    if available:
+        return [h.base for h in available]
+
+    blocked.sort(key=lambda h: h.open_until)
+    return [h.base for h in blocked]
+
+
+# ===============================
+# ワーカー間の共有
+# ===============================
+# インスタンスごとに最後に書いたワーカーの記録を正とする（last writer wins）。
+# open_until は monotonic なので UNIX 秒に直して書く
+def _publish(h):
+    wall = time.time()
+    now = time.monotonic()
+    h.changed_at = wall
+
+    if h.state == h.published_state and now - h.published < SYNC_INTERVAL:
+        return
+
+    h.published = now
+    h.published_state = h.state
+    shared.put("health", h.base, {
+        "pid": os.getpid(),
+        "state": h.state,
+        "openUntil": wall + h.open_until - now,
+        "openSeconds": h.open_seconds,
+        "latency": h.latency,
+        "errorRate": h.error_rate,
+        "unusableRate": h.unusable_rate,
+    }, SHARED_TTL)
+
+
+def _adopt(h, record, updated):
+    h.changed_at = updated
+    h.latency = record["latency"]
+    h.error_rate = record["errorRate"]
+    h.unusable_rate = record["unusableRate"]
+    h.open_seconds = record["openSeconds"]
+
+    if record["state"] == CLOSED:
+        # 自分が試行中（half-open）ならその結果を待つ
+        if h.state != HALF_OPEN:
+            h.state = CLOSED
+            h.consecutive_failures = 0
+        return
+
+    # 他のワーカーの half-open は、こちらからは開いているものとして扱う
+    if h.state != HALF_OPEN:
+        h.state = OPEN
+        h.open_until = time.monotonic() + record["openUntil"] - time.time()
+
+
+def _sync():
+    global _synced, _synced_at
+    now = time.monotonic()
+    if now - _synced < SYNC_INTERVAL:
+        return
+    _synced = now
+
+    # 書き込みの確定順と updated の順は前後しうるので、少し戻って読む（取り込み済みは changed_at で弾く）
+    pid = os.getpid()
+    for base, record, updated in shared.changed("health", _synced_at - SYNC_INTERVAL):
+        _synced_at = max(_synced_at, updated)
+        h = get(base)
+        if record.get("pid") != pid and updated > h.changed_at:
+            _adopt(h, record, updated)
+
+
+def snapshot():
+    return [h.snapshot() for h in _instances.values()]
@@ -0,0 +1,227 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import aclosing
+
+import muxcache
+from mux import MuxError
+
+# ===============================
+# Mux Job Scheduler
+# ===============================
+# ffmpeg の同時実行数を WORKERS に抑え、待ち行列が QUEUE_SIZE を超えたら断る。
+# 同じキー（video_id + quality + 出力プロファイル）の要求は実行中のジョブに相乗りする。
+# produce は fragmented なら chunk を返す async iterator を作る関数、
+# そうでなければ出力先パスを受け取って成功なら真を返す coroutine 関数
+WORKERS = int(os.environ.get("MUX_WORKERS", str(os.cpu_count() or 1)))
+QUEUE_SIZE = int(os.environ.get("MUX_QUEUE_SIZE", str(WORKERS * 4)))
+
+READ_SIZE = 64 * 1024
+DEFAULT_RETRY_AFTER = 10
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__("mux queue full")
+        self.retry_after = retry_after
+
+
+class MuxJob:
+    def __init__(self, key, produce, fragmented, ext):
+        self.key = key
+        self.produce = produce
+        self.fragmented = fragmented
+        self.ext = ext
+        self.tmp = muxcache.temp_path(key)
+        self.path = None
+        self.size = 0
+        self.error = None
+        self.done = False
+        self.followers = 0
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.task = None
+        self._changed = asyncio.Event()
+
+    # 書き込みが進んだ / 終わったことを待っている全員に知らせる
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class Scheduler:
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.jobs = {}
+        self.queued = 0
+        self.running = 0
+        self.stats = {
+            "submitted": 0,
+            "deduped": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+        }
+        self._slots = asyncio.Semaphore(workers)
+        self._waits = deque(maxlen=100)
+        self._runs = deque(maxlen=100)
+
+    def idle(self):
+        return self.queued + self.running < self.workers
+
+    def submit(self, key, produce, fragmented=False, ext="mp4"):
+        job = self.jobs.get(key)
+        if job is not None:
+            self.stats["deduped"] += 1
+            return job
+
+        if self.queued + self.running >= self.workers + self.queue_size:
+            self.stats["rejected"] += 1
+            raise QueueFull(self.retry_after())
+
+        job = MuxJob(key, produce, fragmented, ext)
+        self.jobs[key] = job
+        self.queued += 1
+        self.stats["submitted"] += 1
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    async def _run(self, job):
+        acquired = False
+
+        try:
+            await self._slots.acquire()
+            acquired = True
+            self.queued -= 1
+            self.running += 1
+            job.started = time.monotonic()
+            self._waits.append(job.started - job.created)
+
+            if job.fragmented:
+                await self._run_fragmented(job)
+            elif not await job.produce(job.tmp):
+                raise MuxError("ffmpeg failed")
+
+            job.path = muxcache.publish(job.tmp, job.key, job.ext)
+            self.stats["completed"] += 1
+        except asyncio.CancelledError:
+            self.stats["cancelled"] += 1
+            muxcache.discard(job.tmp)
+        except Exception as e:
+            print("mux job error:", job.key, e)
+            job.error = e
+            self.stats["failed"] += 1
+            muxcache.discard(job.tmp)
+        finally:
+            job.finished = time.monotonic()
+            if acquired:
+                self.running -= 1
+                self._runs.append(job.finished - job.started)
+                self._slots.release()
+            else:
+                self.queued -= 1
+
+            job.done = True
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            job.notify()
+
+    async def _run_fragmented(self, job):
+        chunks = job.produce()
+
+        async with aclosing(chunks):
+            with open(job.tmp, "wb") as f:
+                async for chunk in chunks:
+                    f.write(chunk)
+                    f.flush()
+                    job.size += len(chunk)
+                    job.notify()
+
+    # fragmented ジョブの出力を、書かれた分から順に流す。
+    # 見ている人が全員いなくなったらジョブ（ffmpeg）ごと止める
+    async def follow(self, job):
+        job.followers += 1
+        offset = 0
+        f = None
+
+        try:
+            while True:
+                changed = job._changed
+
+                if job.size > offset:
+                    if f is None:
+                        f = open(job.path or job.tmp, "rb")
+                    data = f.read(min(job.size - offset, READ_SIZE))
+                    if not data:
+                        raise MuxError("mux output disappeared")
+                    offset += len(data)
+                    yield data
+                    continue
+
+                if job.done:
+                    if job.path is None:
+                        raise job.error or MuxError("mux cancelled")
+                    break
+
+                await changed.wait()
+        finally:
+            if f is not None:
+                f.close()
+            job.followers -= 1
+            if job.followers == 0 and not job.done:
+                job.task.cancel()
+
+    # 最初のバイトが書かれるまで（か失敗するまで）待ってから follow を返す。
+    # 失敗したら例外を上げるので、レスポンスを始める前にエラーで返せる
+    async def follow_started(self, job):
+        stream = self.follow(job)
+        try:
+            first = await anext(stream)
+        except StopAsyncIteration:
+            raise MuxError("mux produced no output")
+        except BaseException:
+            await stream.aclose()
+            raise
+        return _prepend(first, stream)
+
+    async def wait(self, job):
+        while not job.done:
+            await job._changed.wait()
+        return job.path
+
+    def retry_after(self):
+        if not self._runs:
+            return DEFAULT_RETRY_AFTER
+        avg = sum(self._runs) / len(self._runs)
+        return max(1, math.ceil(avg * (self.queued + 1) / self.workers))
+
+    def snapshot(self):
+        def avg(values):
+            return round(sum(values) / len(values), 3) if values else None
+
+        return {
+            "workers": self.workers,
+            "queueSize": self.queue_size,
+            "queued": self.queued,
+            "running": self.running,
+            "avgWait": avg(self._waits),
+            "avgRun": avg(self._runs),
+            "maxRun": round(max(self._runs), 3) if self._runs else None,
+            **self.stats,
+        }
+
+
+# 先に読んだ chunk を頭に付けて残りを流す。閉じられたら元の follow も閉じる（ffmpeg を止めるため）
+async def _prepend(first, stream):
+    async with aclosing(stream):
+        yield first
+        async for data in stream:
+            yield data
+
+
+scheduler = Scheduler()
@@ -0,0 +1,179 @@
+import os
+import time
+from contextvars import ContextVar
+
+# ===============================
+# Metrics（Prometheus テキスト形式）
+# ===============================
+# 外部ライブラリなしのカウンタとヒストグラム。/metrics で render() を返す。
+# SERVER_TIMING=1 ならリクエスト中の時間を timing() で貯めて Server-Timing ヘッダにする
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FFMPEG_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_metrics = []
+_timings = ContextVar("timings", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket ごとの件数..., sum, count]
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [0] * (len(self.buckets) + 2)
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+                break
+        entry[-2] += value
+        entry[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, entry in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, entry):
+                cumulative += n
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, [le])} {cumulative}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labels, labels, [inf])} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {round(entry[-2], 6)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {entry[-1]}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# ===============================
+# 各モジュールから使うメトリクス
+# ===============================
+http_requests = Histogram(
+    "sennin_http_request_duration_seconds",
+    "Time to response headers per endpoint",
+    ("route", "method", "status"),
+)
+upstream_requests = Histogram(
+    "sennin_upstream_request_duration_seconds",
+    "Upstream request latency per instance",
+    ("instance", "outcome"),
+)
+upstream_outcomes = Counter(
+    "sennin_upstream_requests_total",
+    "Upstream requests per instance by outcome (ok, rejected, timeout, status, parse, error, cancelled)",
+    ("instance", "outcome"),
+)
+upstream_answered = Counter(
+    "sennin_upstream_answer_index_total",
+    "Position in the instance order of the instance that answered (none = every instance failed)",
+    ("api", "index"),
+)
+cache_lookups = Counter(
+    "sennin_cache_lookups_total",
+    "Response cache lookups by kind and status",
+    ("kind", "status"),
+)
+ffmpeg_duration = Histogram(
+    "sennin_ffmpeg_duration_seconds",
+    "ffmpeg run time by job kind",
+    ("kind",),
+    buckets=FFMPEG_BUCKETS,
+)
+ffmpeg_exits = Counter(
+    "sennin_ffmpeg_exit_total",
+    "ffmpeg exit status by job kind (killed = cancelled before exit)",
+    ("kind", "code"),
+)
+
+
+# ===============================
+# Server-Timing / リクエストごとの計測
+# ===============================
+# 同じ名前は足し合わせる（並行した上流リクエストは合計時間になる）
+def timing(name, seconds):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + seconds
+
+
+def server_timing_header(timings, total):
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# レスポンスヘッダを送る時点までの時間をルートごとに記録する ASGI ミドルウェア。
+# StreamingResponse の本体には手を出さない（切断がそのままジェネレータに伝わるように）
+class RequestMetrics:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.monotonic()
+        timings = {} if SERVER_TIMING else None
+        _timings.set(timings)
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.monotonic() - start
+                route = scope.get("route")
+                http_requests.observe(
+                    elapsed,
+                    getattr(route, "path", "unmatched"),
+                    scope["method"],
+                    str(message["status"]),
+                )
+                if timings is not None:
+                    header = server_timing_header(timings, elapsed)
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"server-timing", header.encode()),
+                    ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_metrics)
@@ -1,347 +1,137 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
-import requests
-import random
-import os
-import subprocess
-import uuid
+import re
 
-app = FastAPI()
+from fastapi import APIRouter, HTTPException, Request
 
-# ===============================
-# Static
-# ===============================
-# Render で statics が無くても即死しないようにする
-if os.path.isdir("statics"):
-    app.mount("/static", StaticFiles(directory="statics"), name="static")
-
-    # ★ 仙人music
-    if os.path.isdir("statics/music"):
-        app.mount("/music", StaticFiles(directory="statics/music", html=True), name="music")
-    else:
-        print("⚠ statics/music directory not found (skipped mount)")
-else:
-    print("⚠ statics directory not found (skipped mount)")
-
-@app.get("/")
-def root():
-    if os.path.isfile("statics/index.html"):
-        return FileResponse("statics/index.html")
-    return {"status": "index.html not found"}
+import cache
+import delivery
+import health
+import searchindex
+from formats import primary_lang
+from sources import (
+    CACHE_TTL,
+    LATENCY_BUDGET,
+    SEARCH_APIS,
+    get_video_info,
+    proxy_format,
+    search_accept,
+)
+from upstream import hedged_json
 
 # ===============================
-# API BASE LIST
+# ★ 仙人music
 # ===============================
-VIDEO_APIS = [
-    "https://iv.melmac.space",
-    "https://pol1.iv.ggtyler.dev",
-    "https://cal1.iv.ggtyler.dev",
-    "https://invidious.0011.lt",
-    "https://yt.omada.cafe",
-]
-
-SEARCH_APIS = VIDEO_APIS
-
-COMMENTS_APIS = [
-    "https://invidious.lunivers.trade",
-    "https://invidious.ducks.party",
-    "https://super8.absturztau.be",
-    "https://invidious.nikkosphere.com",
-    "https://yt.omada.cafe",
-    "https://iv.melmac.space",
-    "https://iv.duti.dev",
-]
-
-EDU_STREAM_API_BASE_URL = "https://raw.githubusercontent.com/toka-kun/Education/refs/heads/main/keys/key1.json"
-STREAM_YTDL_API_BASE_URL = "https://yudlp.vercel.app/stream/"
-SHORT_STREAM_API_BASE_URL = "https://yt-dl-kappa.vercel.app/short/"
-
-TIMEOUT = 6
-
-HEADERS = {
-    "User-Agent": "Mozilla/5.0"
-}
+# 音楽向けの検索と、音声トラックだけの再生。映像や ffmpeg には触れない
+router = APIRouter(prefix="/music")
 
-# ===============================
-# Utils
-# ===============================
-def try_json(url, params=None):
-    try:
-        r = requests.get(url, params=params, headers=HEADERS, timeout=TIMEOUT)
-        if r.status_code == 200:
-            return r.json()
-    except Exception as e:
-        print("request error:", e)
-    return None
-
-def pick_video_audio(formats, quality="best"):
-    video_url = None
-    audio_url = None
-
-    for f in formats:
-        if f.get("type", "").startswith("video") and f.get("url"):
-            if quality == "best" or quality in (f.get("qualityLabel") or ""):
-                video_url = f["url"]
-                break
-
-    # ★ 日本語音声のみ
-    for f in formats:
-        if f.get("type", "").startswith("audio") and f.get("url"):
-            lang = (f.get("language") or "").lower()
-            audio_track = str(f.get("audioTrack") or "").lower()
-            if "ja" not in lang and "japanese" not in audio_track:
-                continue
-            audio_url = f["url"]
-            break
-
-    return video_url, audio_url
-
-def mux_video_audio_ios(video_url, audio_url):
-    out = f"/tmp/{uuid.uuid4()}.mp4"
-
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-i", video_url,
-        "-i", audio_url,
-        "-map", "0:v:0",
-        "-map", "1:a:0",
-        "-c:v", "libx264",
-        "-profile:v", "main",
-        "-level", "3.1",
-        "-pix_fmt", "yuv420p",
-        "-c:a", "aac",
-        "-movflags", "+faststart",
-        out
-    ]
-
-    subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-    return out
+# 曲として扱う長さ（秒）。これより短い / 長いもの（ショート・作業用 BGM など）は外す
+MUSIC_MIN_SECONDS = 30
+MUSIC_MAX_SECONDS = 1200
 
-# ===============================
-# Search
-# ===============================
-@app.get("/api/search")
-def api_search(q: str):
-    results = []
-    random.shuffle(SEARCH_APIS)
-
-    for base in SEARCH_APIS:
-        data = try_json(f"{base}/api/v1/search", {"q": q, "type": "video"})
-        if not isinstance(data, list):
-            continue
+# 日本語音声を優先する
+MUSIC_LANG = "ja"
 
-        for v in data:
-            if not v.get("videoId"):
-                continue
+# 公式音源っぽいものを上に出す
+OFFICIAL_TITLE = re.compile(r"official|audio|lyric|music video|\bmv\b|歌ってみた", re.I)
 
-            results.append({
-                "videoId": v.get("videoId"),
-                "title": v.get("title"),
-                "author": v.get("author"),
-                "authorId": v.get("authorId"),
-            })
+CODECS = {"opus": "opus", "m4a": "mp4a"}
 
-        if results:
-            return {
-                "count": len(results),
-                "results": results,
-                "source": base
-            }
 
-    raise HTTPException(status_code=503, detail="Search unavailable")
+def music_score(v):
+    score = 0
+    author = v.get("author") or ""
+    if author.endswith(" - Topic"):
+        score += 2
+    if "VEVO" in author:
+        score += 1
+    if OFFICIAL_TITLE.search(v.get("title") or ""):
+        score += 1
+    return score
 
-# ===============================
-# Video Info
-# ===============================
-@app.get("/api/video")
-def api_video(video_id: str):
-    random.shuffle(VIDEO_APIS)
 
-    for base in VIDEO_APIS:
-        data = try_json(f"{base}/api/v1/videos/{video_id}")
-        if data:
-            return {
-                "title": data.get("title"),
-                "author": data.get("author"),
-                "description": data.get("description"),
-                "viewCount": data.get("viewCount"),
-                "lengthSeconds": data.get("lengthSeconds"),
-                "source": base
-            }
+def music_tracks(data):
+    tracks = []
 
-    raise HTTPException(status_code=503, detail="Video info unavailable")
+    for v in data or []:
+        if not isinstance(v, dict) or not v.get("videoId"):
+            continue
+
+        length = v.get("lengthSeconds")
+        if isinstance(length, int) and not MUSIC_MIN_SECONDS <= length <= MUSIC_MAX_SECONDS:
+            continue
+
+        tracks.append((music_score(v), {
+            "id": v["videoId"],
+            "title": v.get("title"),
+            "username": v.get("author"),
+            "authorId": v.get("authorId"),
+            "artwork_url": f"https://i.ytimg.com/vi/{v['videoId']}/mqdefault.jpg",
+            "duration": length,
+            "stream_url": f"/music/stream?video_id={v['videoId']}",
+        }))
+
+    # sorted は安定なので同点は上流の順のまま
+    return [t for _, t in sorted(tracks, key=lambda t: -t[0])]
+
+
+@router.get("/search")
+async def music_search(request: Request, q: str, page: int = 1):
+    page = max(page, 1)
+
+    async def fetch():
+        data, base = await hedged_json(
+            health.order(SEARCH_APIS),
+            "/api/v1/search",
+            {"q": q, "type": "video", "page": page},
+            accept=search_accept,
+            budget=LATENCY_BUDGET["search"],
+        )
 
-# ===============================
-# Comments
-# ===============================
-@app.get("/api/comments")
-def api_comments(video_id: str):
-    for base in COMMENTS_APIS:
-        data = try_json(f"{base}/api/v1/comments/{video_id}")
         if data:
+            searchindex.add(data)
+            tracks = music_tracks(data)
             return {
-                "comments": [
-                    {
-                        "author": c.get("author"),
-                        "content": c.get("content")
-                    }
-                    for c in data.get("comments", [])
-                ],
+                "count": len(tracks),
+                "tracks": tracks,
                 "source": base
             }
-    return {"comments": [], "source": None}
 
-# ===============================
-# Channel（完全版・修整済）
-# ===============================
-@app.get("/api/channel")
-def api_channel(c: str):
-    random.shuffle(VIDEO_APIS)
+    result, status = await cache.cached(f"music:{q}:{page}", CACHE_TTL["search"], fetch)
+    if result is None:
+        raise HTTPException(status_code=503, detail="Search unavailable")
 
-    for base in VIDEO_APIS:
-        ch = try_json(f"{base}/api/v1/channels/{c}")
-        if not ch:
-            continue
+    return delivery.json_response(request, {**result, "page": page, "nextPage": page + 1}, status)
 
-        latest_videos = []
-
-        for v in ch.get("latestVideos", []):
-            published_raw = v.get("published")
-            published_iso = None
-
-            if isinstance(published_raw, str):
-                try:
-                    published_iso = published_raw.replace("Z", "+00:00")
-                except:
-                    published_iso = None
-
-            latest_videos.append({
-                "videoId": v.get("videoId"),
-                "title": v.get("title"),
-                "author": ch.get("author"),
-                "authorId": c,
-                "viewCount": v.get("viewCount") or 0,
-                "viewCountText": v.get("viewCountText") or "0 回視聴",
-                "published": published_iso,
-                "publishedText": v.get("publishedText") or ""
-            })
-
-        view_count = ch.get("viewCount")
-        video_count = ch.get("videoCount")
-        joined_date = ch.get("joinedDate")
-
-        if not isinstance(video_count, int):
-            video_count = len(latest_videos)
-
-        if not isinstance(joined_date, str):
-            published_dates = [
-                v["published"]
-                for v in latest_videos
-                if isinstance(v.get("published"), str)
-            ]
-            joined_date = min(published_dates) if published_dates else None
-
-        related_channels = []
-
-        for r in ch.get("relatedChannels", []):
-            icon = None
-            thumbs = r.get("authorThumbnails")
-
-            if isinstance(thumbs, list) and thumbs:
-                icon = thumbs[-1].get("url")
-
-            related_channels.append({
-                "channelId": r.get("authorId"),
-                "name": r.get("author"),
-                "icon": icon,
-                "subCountText": r.get("subCountText") or "?"
-            })
-
-        return {
-            "author": ch.get("author"),
-            "authorId": c,
-            "authorThumbnails": ch.get("authorThumbnails"),
-            "description": ch.get("description") or "",
-            "subCount": ch.get("subCount") or 0,
-            "viewCount": view_count or 0,
-            "videoCount": video_count,
-            "joinedDate": joined_date,
-            "latestVideos": latest_videos,
-            "relatedChannels": related_channels,
-            "source": base
-        }
-
-    raise HTTPException(status_code=503, detail="Channel unavailable")
 
-# ===============================
-# Stream（iOS対応・映像＋音声合成）
-# ===============================
-@app.get("/api/stream")
-def api_stream(video_id: str, quality: str = "best"):
-    for base in VIDEO_APIS:
-        data = try_json(f"{base}/api/v1/videos/{video_id}")
-        if not data:
-            continue
+def is_ios(request):
+    ua = request.headers.get("user-agent") or ""
+    return any(k in ua for k in ("iPhone", "iPad", "iPod"))
 
-        video_url, audio_url = pick_video_audio(
-            data.get("adaptiveFormats", []),
-            quality
-        )
 
-        if not video_url or not audio_url:
-            continue
+# lang の音声があればその中から、codec（opus / m4a）指定があればそれを優先して一番高音質なもの
+def pick_audio(table, lang=MUSIC_LANG, codec=None):
+    lang = primary_lang(lang)
+    audios = [a for a in table.audios if a["lang"] == lang] or table.audios
 
-        output = mux_video_audio_ios(video_url, audio_url)
+    if codec in CODECS:
+        audios = [a for a in audios if a["codec"] == CODECS[codec]] or audios
 
-        return FileResponse(
-            output,
-            media_type="video/mp4",
-            filename=f"{video_id}.mp4"
-        )
+    return audios[0]["format"] if audios else None
 
-    raise HTTPException(status_code=503, detail="Stream unavailable")
 
-# ===============================
-# Stream URL ONLY（旧）
-# ===============================
-@app.get("/api/streamurl")
-def api_streamurl(video_id: str, quality: str = "best"):
-    for base in VIDEO_APIS:
-        data = try_json(f"{base}/api/v1/videos/{video_id}")
-        if not data:
-            continue
+# codec 未指定なら iOS には m4a、それ以外はビットレート順（たいてい opus）
+@router.get("/stream")
+async def music_stream(request: Request, video_id: str, codec: str = None, lang: str = MUSIC_LANG):
+    if codec is None and is_ios(request):
+        codec = "m4a"
 
-        video_url = None
-        audio_url = None
-
-        for f in data.get("adaptiveFormats", []):
-            if f.get("type", "").startswith("video") and f.get("url"):
-                label = f.get("qualityLabel") or ""
-                if quality == "best" or quality in label:
-                    video_url = f["url"]
-                    break
-
-        # ★ 日本語音声のみ
-        for f in data.get("adaptiveFormats", []):
-            if f.get("type", "").startswith("audio") and f.get("url"):
-                lang = (f.get("language") or "").lower()
-                audio_track = str(f.get("audioTrack") or "").lower()
-                if "ja" not in lang and "japanese" not in audio_track:
-                    continue
-                audio_url = f["url"]
-                break
-
-        if video_url and audio_url:
-            return {
-                "video": video_url,
-                "audio": audio_url,
-                "source": base
-            }
+    info = await get_video_info(
+        video_id,
+        formats=True,
+        accept=lambda table: pick_audio(table, lang, codec) is not None,
+    )
 
-    raise HTTPException(status_code=503, detail="Stream unavailable")
+    audio = pick_audio(info.table, lang, codec) if info else None
+    if not audio:
+        raise HTTPException(status_code=503, detail="Audio unavailable")
 
-from music import router as music_router
-app.include_router(music_router)
+    return await proxy_format(request, video_id, audio)
@@ -0,0 +1,216 @@
+import asyncio
+import os
+import re
+import subprocess
+import time
+import uuid
+
+import metrics
+
+# ===============================
+# Mux（iOS対応・映像＋音声合成）
+# ===============================
+CHUNK_SIZE = 64 * 1024
+
+IOS_CODEC_ARGS = [
+    "-c:v", "libx264",
+    "-profile:v", "main",
+    "-level", "3.1",
+    "-pix_fmt", "yuv420p",
+    "-c:a", "aac",
+]
+
+# 再エンコードするときの上限の高さと、出力の高さごとの x264 preset
+TRANSCODE_MAX_HEIGHT = int(os.environ.get("MUX_MAX_HEIGHT", "720"))
+TRANSCODE_PRESETS = [
+    (1080, "ultrafast"),
+    (720, "superfast"),
+    (480, "veryfast"),
+    (0, "faster"),
+]
+
+stats = {"copy": 0, "copy+aac": 0, "transcode": 0}
+
+# moov を先頭に置き、キーフレームごとに moof を出すので
+# 書き終わりを待たずにパイプから流せる
+FRAGMENTED_MP4_ARGS = [
+    "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+    "-f", "mp4",
+]
+
+
+class MuxError(Exception):
+    pass
+
+
+def is_ios_video(f):
+    t = f.get("type") or ""
+    return t.startswith("video/mp4") and "avc1" in t
+
+
+def is_ios_audio(f):
+    t = f.get("type") or ""
+    return t.startswith("audio/mp4") and "mp4a" in t
+
+
+def format_height(f):
+    m = re.match(r"(\d+)p", f.get("qualityLabel") or "")
+    if m:
+        return int(m.group(1))
+    m = re.match(r"\d+x(\d+)", f.get("size") or "")
+    return int(m.group(1)) if m else None
+
+
+def transcode_args(height):
+    height = min(height or TRANSCODE_MAX_HEIGHT, TRANSCODE_MAX_HEIGHT)
+    preset = next(p for h, p in TRANSCODE_PRESETS if height >= h)
+
+    return [
+        "-c:v", "libx264",
+        "-preset", preset,
+        "-profile:v", "main",
+        "-level", "3.1" if height <= 720 else "4.0",
+        "-pix_fmt", "yuv420p",
+        "-vf", f"scale=-2:'min(ih,{TRANSCODE_MAX_HEIGHT})'",
+    ]
+
+
+# 入力がそのまま iOS で再生できるなら -c copy、ダメなほうだけ再エンコードする。
+# 戻り値は (ffmpeg の codec 引数, "copy" | "copy+aac" | "transcode")
+def mux_plan(video, audio):
+    copy_video = is_ios_video(video)
+    copy_audio = is_ios_audio(audio)
+
+    args = ["-c:v", "copy"] if copy_video else transcode_args(format_height(video))
+    args += ["-c:a", "copy"] if copy_audio else ["-c:a", "aac"]
+
+    if not copy_video:
+        path = "transcode"
+    elif copy_audio:
+        path = "copy"
+    else:
+        path = "copy+aac"
+    return args, path
+
+
+# HLS セグメントは切り出し位置がキーフレームに揃わないので映像は常に再エンコードする
+def segment_args(video):
+    return transcode_args(format_height(video)) + ["-c:a", "aac"]
+
+
+def _input_args(video_url, audio_url):
+    return [
+        "-i", video_url,
+        "-i", audio_url,
+        "-map", "0:v:0",
+        "-map", "1:a:0",
+    ]
+
+
+# 終わっていなければ kill して、実行時間と終了コードを記録する
+async def _finish(proc, kind, started):
+    code = "killed" if proc.returncode is None else str(proc.returncode)
+    if proc.returncode is None:
+        proc.kill()
+        await proc.wait()
+
+    metrics.ffmpeg_duration.observe(time.monotonic() - started, kind)
+    metrics.ffmpeg_exits.inc(kind, code)
+
+
+# 成功したら出力パス、ffmpeg が失敗したら None。キャンセルされたら ffmpeg を kill する
+async def mux_video_audio_ios(video_url, audio_url, codec_args=IOS_CODEC_ARGS, out=None):
+    out = out or f"/tmp/{uuid.uuid4()}.mp4"
+
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-loglevel", "error",
+        *_input_args(video_url, audio_url),
+        *codec_args,
+        "-movflags", "+faststart",
+        "-f", "mp4",
+        out
+    ]
+
+    started = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        returncode = await proc.wait()
+    finally:
+        await _finish(proc, "file", started)
+
+    return out if returncode == 0 else None
+
+
+# fragmented MP4 を stdout に書かせてチャンクごとに返す。
+# クライアントが切断してジェネレータが閉じられたら ffmpeg を kill する
+async def stream_video_audio_ios(video_url, audio_url, codec_args=IOS_CODEC_ARGS):
+    cmd = [
+        "ffmpeg",
+        "-loglevel", "error",
+        *_input_args(video_url, audio_url),
+        *codec_args,
+        *FRAGMENTED_MP4_ARGS,
+        "pipe:1",
+    ]
+
+    started = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        while True:
+            chunk = await proc.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+        if await proc.wait() != 0:
+            raise MuxError(f"ffmpeg exited with {proc.returncode}")
+    finally:
+        await _finish(proc, "fragmented", started)
+
+
+# start 秒から duration 秒だけを MPEG-TS に切り出す（HLS セグメント用）。
+# 入力側で -ss するので googlevideo には Range で必要な所だけ取りに行く
+async def mux_segment(video_url, audio_url, start, duration, codec_args, out):
+    cmd = [
+        "ffmpeg",
+        "-y",
+        "-loglevel", "error",
+        "-ss", str(start), "-t", str(duration), "-i", video_url,
+        "-ss", str(start), "-t", str(duration), "-i", audio_url,
+        "-map", "0:v:0",
+        "-map", "1:a:0",
+        *codec_args,
+        "-output_ts_offset", str(start),
+        "-muxdelay", "0",
+        "-f", "mpegts",
+        out
+    ]
+
+    started = time.monotonic()
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        returncode = await proc.wait()
+    finally:
+        await _finish(proc, "segment", started)
+
+    return out if returncode == 0 else None
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import time
+import uuid
+
+# ===============================
+# Mux Output Cache
+# ===============================
+# video_id + quality + 出力プロファイルで決まるキーに mux 済み mp4（と HLS の ts）を置く。
+# 書き込みは .part に書いてから rename、合計サイズを超えたら最終アクセスの古い順に消す
+EXTENSIONS = (".mp4", ".ts")
+
+CACHE_DIR = os.environ.get("MUX_CACHE_DIR", "/tmp/sennin-mux")
+MAX_BYTES = int(os.environ.get("MUX_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# これだけ書き込みの無い .part は書きかけのまま放置されたものとみなす
+PARTIAL_IDLE_SECONDS = 600
+
+stats = {"hits": 0, "misses": 0, "published": 0, "evicted": 0}
+
+
+def key(video_id, quality, profile):
+    raw = f"{video_id}|{quality}|{profile}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def path_for(k, ext="mp4"):
+    return os.path.join(CACHE_DIR, f"{k}.{ext}")
+
+
+def etag(k):
+    return f'"{k}"'
+
+
+# 最終アクセスは atime に記録する（mtime は ETag / Last-Modified に使われるので触らない）
+def lookup(k, ext="mp4"):
+    path = path_for(k, ext)
+    try:
+        st = os.stat(path)
+        os.utime(path, (time.time(), st.st_mtime))
+    except FileNotFoundError:
+        stats["misses"] += 1
+        return None
+
+    stats["hits"] += 1
+    return path
+
+
+def temp_path(k):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return os.path.join(CACHE_DIR, f"{k}.{uuid.uuid4().hex}.part")
+
+
+def publish(tmp, k, ext="mp4"):
+    path = path_for(k, ext)
+    os.replace(tmp, path)
+    stats["published"] += 1
+    evict()
+    return path
+
+
+def discard(tmp):
+    try:
+        os.remove(tmp)
+    except FileNotFoundError:
+        pass
+
+
+def evict():
+    stats["evicted"] += evict_dir(CACHE_DIR, MAX_BYTES, EXTENSIONS)
+
+
+# directory 内の extensions のファイルが max_bytes に収まるまで最終アクセスの古い順に消す。
+# 消した数を返す
+def evict_dir(directory, max_bytes, extensions):
+    entries = []
+    total = 0
+    evicted = 0
+
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+
+    for name in names:
+        if not name.endswith(extensions):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_atime, st.st_size, path))
+        total += st.st_size
+
+    entries.sort()
+
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        discard(path)
+        total -= size
+        evicted += 1
+
+    return evicted
+
+
+# 前回の書きかけ（.part）を消す。--workers N では他のワーカーが書いている最中のものもあるので、
+# しばらく更新されていないものだけにする
+def remove_partials(directory, idle=PARTIAL_IDLE_SECONDS):
+    os.makedirs(directory, exist_ok=True)
+    now = time.time()
+
+    for name in os.listdir(directory):
+        if not name.endswith(".part"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) < idle:
+                continue
+        except FileNotFoundError:
+            continue
+        discard(path)
+
+
+def cleanup():
+    remove_partials(CACHE_DIR)
+    evict()
+
+
+def snapshot():
+    size = 0
+    files = 0
+    try:
+        for name in os.listdir(CACHE_DIR):
+            if name.endswith(EXTENSIONS):
+                size += os.path.getsize(os.path.join(CACHE_DIR, name))
+                files += 1
+    except (FileNotFoundError, OSError):
+        pass
+
+    return {"files": files, "bytes": size, "maxBytes": MAX_BYTES, **stats}
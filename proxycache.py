@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+
+import muxcache
+from upstream import media_client
+
+# ===============================
+# Byte Proxy Cache
+# ===============================
+# googlevideo のバイト列を BLOCK_SIZE ごとのブロックに区切って
+# video_id + itag + ブロック番号でディスクに置く。人気動画の先頭は 2 人目以降ローカルから返る
+CACHE_DIR = os.environ.get("PROXY_CACHE_DIR", "/tmp/sennin-proxy")
+MAX_BYTES = int(os.environ.get("PROXY_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+BLOCK_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+_evicting = None
+_evict_again = False
+
+
+# video_id はクエリから来るのでそのままパスに使わず、muxcache.key と同じくハッシュにする
+def block_path(video_id, itag, block):
+    k = hashlib.sha1(f"{video_id}|{itag}".encode()).hexdigest()
+    return os.path.join(CACHE_DIR, f"{k}_{block}.bin")
+
+
+def cleanup():
+    muxcache.remove_partials(CACHE_DIR)
+    stats["evicted"] += muxcache.evict_dir(CACHE_DIR, MAX_BYTES, (".bin",))
+
+
+# ブロックが増えるたびに上限を見直す。ディレクトリの走査はイベントループを止めないよう別スレッドで、
+# 同時には 1 本だけ（走っている間に増えた分は、終わったあともう一度だけ見る）
+def schedule_evict():
+    global _evicting, _evict_again
+    if _evicting is not None and not _evicting.done():
+        _evict_again = True
+        return
+    _evicting = asyncio.create_task(_evict())
+
+
+async def _evict():
+    global _evict_again
+    while True:
+        _evict_again = False
+        try:
+            stats["evicted"] += await asyncio.to_thread(muxcache.evict_dir, CACHE_DIR, MAX_BYTES, (".bin",))
+        except Exception as e:
+            print("proxy cache evict error:", e)
+        if not _evict_again:
+            return
+
+
+# start〜end（両端含む）のバイトを順に返す。size は format の clen
+async def stream_range(video_id, itag, url, start, end, size):
+    for block in range(start // BLOCK_SIZE, end // BLOCK_SIZE + 1):
+        block_start = block * BLOCK_SIZE
+        block_end = min(block_start + BLOCK_SIZE, size) - 1
+        lo = max(start, block_start) - block_start
+        hi = min(end, block_end) - block_start
+
+        path = block_path(video_id, itag, block)
+
+        if os.path.exists(path):
+            stats["hits"] += 1
+            async for chunk in _read_block(path, lo, hi):
+                yield chunk
+        else:
+            stats["misses"] += 1
+            async for chunk in _fetch_block(path, url, block_start, block_end, lo, hi):
+                yield chunk
+
+
+async def _read_block(path, lo, hi):
+    st = os.stat(path)
+    os.utime(path, (time.time(), st.st_mtime))
+
+    with open(path, "rb") as f:
+        f.seek(lo)
+        remaining = hi - lo + 1
+        while remaining > 0:
+            data = f.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+# ブロック全体を取りに行ってキャッシュに書きつつ、要求された lo〜hi の部分だけ流す
+async def _fetch_block(path, url, block_start, block_end, lo, hi):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.part"
+    headers = {"Range": f"bytes={block_start}-{block_end}"}
+    length = block_end - block_start + 1
+    received = 0
+    done = False
+
+    try:
+        async with media_client().stream("GET", url, headers=headers) as r:
+            # Range を無視して 200 で全体が返ってきても先頭ブロックなら使える
+            if not (r.status_code == 206 or (r.status_code == 200 and block_start == 0)):
+                raise IOError(f"upstream returned {r.status_code}")
+
+            with open(tmp, "wb") as f:
+                async for data in r.aiter_bytes(CHUNK_SIZE):
+                    data = data[:length - received]
+                    if not data:
+                        break
+                    f.write(data)
+                    pos = received
+                    received += len(data)
+
+                    # このチャンクのうち lo〜hi に入る部分
+                    a = max(lo - pos, 0)
+                    b = min(hi - pos + 1, len(data))
+                    if a < b:
+                        yield data[a:b]
+
+        done = received == length
+    finally:
+        if done:
+            os.replace(tmp, path)
+            schedule_evict()
+        else:
+            muxcache.discard(tmp)
+
+
+# clen が分からない format はキャッシュせずにそのまま中継する
+async def passthrough(response):
+    try:
+        async for data in response.aiter_bytes(CHUNK_SIZE):
+            yield data
+    finally:
+        await response.aclose()
+
+
+def snapshot():
+    files = 0
+    size = 0
+    try:
+        for name in os.listdir(CACHE_DIR):
+            if name.endswith(".bin"):
+                files += 1
+                size += os.path.getsize(os.path.join(CACHE_DIR, name))
+    except OSError:
+        pass
+
+    return {"files": files, "bytes": size, "maxBytes": MAX_BYTES, **stats}
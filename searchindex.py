@@ -0,0 +1,282 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# ===============================
+# Local Search Index
+# ===============================
+# 検索・動画・チャンネルで見た動画を SQLite FTS5 に貯めておき、
+# /api/search の即答用と、上流が全滅したときの予備に使う。
+# 書き込みは add() で溜めて flush_loop がまとめて別スレッドで書く
+DB_PATH = os.environ.get("SEARCH_INDEX_PATH", "/tmp/sennin-index.db")
+MAX_ROWS = int(os.environ.get("SEARCH_INDEX_MAX_ROWS", "200000"))
+FLUSH_INTERVAL = float(os.environ.get("SEARCH_INDEX_FLUSH_INTERVAL", "5"))
+PAGE_SIZE = 20
+
+# trigram トークナイザなら日本語も分かち書きなしで部分一致できる（3 文字未満は LIKE）
+TRIGRAM_MIN = 3
+# 3 文字未満の語だけのクエリで LIKE をかける件数（最後に見た時刻の新しい順）
+SHORT_SCAN_ROWS = int(os.environ.get("SEARCH_INDEX_SHORT_SCAN_ROWS", "20000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    video_id TEXT UNIQUE NOT NULL,
+    title TEXT,
+    author TEXT,
+    author_id TEXT,
+    view_count INTEGER,
+    published INTEGER,
+    seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS videos_seen ON videos(seen);
+CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(
+    title, author, content='videos', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS videos_ai AFTER INSERT ON videos BEGIN
+    INSERT INTO videos_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+END;
+CREATE TRIGGER IF NOT EXISTS videos_ad AFTER DELETE ON videos BEGIN
+    INSERT INTO videos_fts(videos_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+END;
+CREATE TRIGGER IF NOT EXISTS videos_au AFTER UPDATE ON videos BEGIN
+    INSERT INTO videos_fts(videos_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author);
+    INSERT INTO videos_fts(rowid, title, author) VALUES (new.id, new.title, new.author);
+END;
+"""
+
+UPSERT = """
+INSERT INTO videos (video_id, title, author, author_id, view_count, published, seen)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(video_id) DO UPDATE SET
+    title = COALESCE(excluded.title, title),
+    author = COALESCE(excluded.author, author),
+    author_id = COALESCE(excluded.author_id, author_id),
+    view_count = COALESCE(excluded.view_count, view_count),
+    published = COALESCE(excluded.published, published),
+    seen = excluded.seen
+"""
+
+_pending = {}
+_reader = None
+_writer = None
+_searcher = None
+_write_lock = threading.Lock()
+_search_lock = threading.Lock()
+
+stats = {"queued": 0, "written": 0, "trimmed": 0, "queries": 0, "flushes": 0}
+
+
+def _connect():
+    os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _reader_conn():
+    global _reader
+    if _reader is None:
+        _reader = _connect()
+    return _reader
+
+
+def _int(value):
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+# 上流の動画 dict（search / videos / latestVideos のどれでも）を書き込み待ちに積む
+def add(items, author=None, author_id=None):
+    now = time.time()
+
+    for v in items or []:
+        if not isinstance(v, dict) or not v.get("videoId"):
+            continue
+
+        row = (
+            v["videoId"],
+            v.get("title"),
+            v.get("author") or author,
+            v.get("authorId") or author_id,
+            _int(v.get("viewCount")),
+            _int(v.get("published")),
+            now,
+        )
+
+        # 同じ動画がまとめて来たら値のある方を残す
+        old = _pending.get(row[0])
+        if old:
+            row = tuple(new if new is not None else prev for new, prev in zip(row, old))
+
+        _pending[row[0]] = row
+        stats["queued"] += 1
+
+
+def _write(rows):
+    global _writer
+    with _write_lock:
+        if _writer is None:
+            _writer = _connect()
+        _upsert(_writer, rows)
+
+
+def _upsert(conn, rows):
+    with conn:
+        conn.executemany(UPSERT, rows)
+
+        total = conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+        if total > MAX_ROWS:
+            # 最後に見た時刻が古いものから消す
+            conn.execute(
+                "DELETE FROM videos WHERE id IN "
+                "(SELECT id FROM videos ORDER BY seen LIMIT ?)",
+                (total - MAX_ROWS,),
+            )
+            stats["trimmed"] += total - MAX_ROWS
+
+
+async def flush():
+    if not _pending:
+        return
+
+    rows = list(_pending.values())
+    _pending.clear()
+
+    try:
+        await asyncio.to_thread(_write, rows)
+        stats["written"] += len(rows)
+        stats["flushes"] += 1
+    except Exception as e:
+        print("search index write error:", e)
+
+
+async def flush_loop(interval=FLUSH_INTERVAL):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await flush()
+    finally:
+        await flush()
+
+
+def _split_terms(q):
+    # 3 文字以上の語は FTS で引き、短い語はその結果に LIKE で絞り込みをかける
+    terms = [t for t in q.split() if t] or [q]
+    long_terms = [t for t in terms if len(t) >= TRIGRAM_MIN]
+    short_terms = [t for t in terms if len(t) < TRIGRAM_MIN]
+    return long_terms, short_terms
+
+
+def _match_query(terms):
+    # 語ごとにフレーズとして AND。FTS5 の演算子はそのまま文字として扱う
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def _like_filter(terms, prefix=""):
+    where = " AND ".join(
+        f"({prefix}title LIKE ? ESCAPE '\\' OR {prefix}author LIKE ? ESCAPE '\\')" for _ in terms
+    )
+    args = []
+    for t in terms:
+        pattern = "%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        args += [pattern, pattern]
+    return where, args
+
+
+def _search(q, page, limit):
+    global _searcher
+    offset = (max(page, 1) - 1) * limit
+    long_terms, short_terms = _split_terms(q)
+
+    if long_terms:
+        where, args = _like_filter(short_terms, "v.") if short_terms else ("1", [])
+        sql = (
+            "SELECT v.video_id, v.title, v.author, v.author_id FROM videos_fts "
+            "JOIN videos v ON v.id = videos_fts.rowid "
+            f"WHERE videos_fts MATCH ? AND {where} "
+            "ORDER BY bm25(videos_fts), v.view_count DESC LIMIT ? OFFSET ?"
+        )
+        args = [_match_query(long_terms), *args]
+    else:
+        # 短い語だけなら索引が効かないので、最近見た SHORT_SCAN_ROWS 件の中だけを探す
+        where, args = _like_filter(short_terms)
+        sql = (
+            "SELECT video_id, title, author, author_id FROM "
+            "(SELECT * FROM videos ORDER BY seen DESC LIMIT ?) "
+            f"WHERE {where} ORDER BY view_count DESC LIMIT ? OFFSET ?"
+        )
+        args = [SHORT_SCAN_ROWS, *args]
+
+    with _search_lock:
+        if _searcher is None:
+            _searcher = _connect()
+        rows = _searcher.execute(sql, (*args, limit, offset)).fetchall()
+
+    return [
+        {"videoId": r[0], "title": r[1], "author": r[2], "authorId": r[3]}
+        for r in rows
+    ]
+
+
+# タイトル・チャンネル名から q を探す。関連度が同じなら再生数の多い順。
+# SQLite はイベントループを止めないよう、専用の接続で別スレッドから読む
+async def search(q, page=1, limit=PAGE_SIZE):
+    stats["queries"] += 1
+    return await asyncio.to_thread(_search, q, page, limit)
+
+
+# 再生数の多い順に limit 件（起動時にサジェストの種にする）
+def popular(limit):
+    rows = _reader_conn().execute(
+        "SELECT title, author FROM videos ORDER BY view_count DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+    return [{"title": r[0], "author": r[1]} for r in rows]
+
+
+# 上限を超えた分を消し、FTS を videos から作り直して詰める（python searchindex.py rebuild）
+def rebuild():
+    conn = _connect()
+    _upsert(conn, [])
+    with conn:
+        conn.execute("INSERT INTO videos_fts(videos_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO videos_fts(videos_fts) VALUES ('optimize')")
+    conn.execute("VACUUM")
+    count = conn.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+    conn.close()
+    return count
+
+
+def close():
+    global _reader, _writer, _searcher
+    for conn in (_reader, _writer, _searcher):
+        if conn is not None:
+            conn.close()
+    _reader = _writer = _searcher = None
+
+
+def snapshot():
+    try:
+        rows = _reader_conn().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+    except sqlite3.Error:
+        rows = None
+
+    return {
+        "rows": rows,
+        "maxRows": MAX_ROWS,
+        "pending": len(_pending),
+        **stats,
+    }
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["rebuild"]:
+        print("rebuilt", rebuild(), "videos")
+    else:
+        print("usage: python searchindex.py rebuild")
+        sys.exit(2)
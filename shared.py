@@ -0,0 +1,237 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ===============================
+# Shared Store（ワーカー間で共有する状態）
+# ===============================
+# uvicorn --workers N で動かしたときに、上流レスポンスのキャッシュ・インスタンスの健康状態・
+# 動画情報（ストリーム URL とその expire）をプロセス間で共有する。
+# 各モジュールはメモリ上のキャッシュを先に見て、無い / 古いときだけここを読む（ホットパスはメモリのまま）。
+# 書き込みは put() で溜めて flush_loop がまとめて別スレッドで書く（イベントループで SQLite を待たない）。
+#
+# バックエンドは SHARED_BACKEND で選ぶ。"sqlite"（既定, WAL モード）か "none"（共有しない）。
+# 別の実装（ローカルの Redis 代わりなど）は register() で足せる。必要なのは
+#   get(ns, key) / set_many([(ns, key, value, ttl, updated)]) / delete(ns, key) / changed(ns, since) /
+#   purge() / stats() / close()
+# で、value は JSON にできる値、時刻はすべて UNIX 秒（monotonic はプロセスごとに違うので使わない）。
+# set_many と purge は別スレッドから呼ばれる
+BACKEND = os.environ.get("SHARED_BACKEND", "sqlite")
+DB_PATH = os.environ.get("SHARED_PATH", "/tmp/sennin-shared.db")
+MAX_ROWS = int(os.environ.get("SHARED_MAX_ROWS", "20000"))
+PURGE_INTERVAL = float(os.environ.get("SHARED_PURGE_INTERVAL", "300"))
+FLUSH_INTERVAL = float(os.environ.get("SHARED_FLUSH_INTERVAL", "0.5"))
+
+# 他のワーカーが書いている最中に待つ上限（秒）。読み込みはこれを超えたら共有を諦めてメモリだけで続ける。
+# 書き込みは別スレッドなので長めに待てる
+BUSY_TIMEOUT = 0.2
+WRITE_TIMEOUT = 5
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    ns TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires REAL NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (ns, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS kv_updated ON kv(ns, updated);
+CREATE INDEX IF NOT EXISTS kv_expires ON kv(expires);
+"""
+
+
+class SQLiteStore:
+    def __init__(self, path=DB_PATH, max_rows=MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self._reader = None
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.errors = 0
+
+    def _connect(self, timeout):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    # 接続はプロセスごとに最初に使うときに開く（fork 前の接続を持ち越さないように）。
+    # 読み込みはイベントループから、書き込みは別スレッドから、それぞれ専用の接続で
+    def _run(self, sql, args=()):
+        try:
+            if self._reader is None:
+                self._reader = self._connect(BUSY_TIMEOUT)
+            return self._reader.execute(sql, args)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print("shared store error:", e)
+            return None
+
+    def _write(self, statements):
+        with self._write_lock:
+            try:
+                if self._writer is None:
+                    self._writer = self._connect(WRITE_TIMEOUT)
+                conn = self._writer
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    for sql, args in statements:
+                        conn.execute(sql, args)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as e:
+                self.errors += 1
+                print("shared store write error:", e)
+
+    def get(self, ns, key):
+        self.reads += 1
+        cur = self._run(
+            "SELECT value FROM kv WHERE ns = ? AND key = ? AND expires > ?",
+            (ns, key, time.time()),
+        )
+        row = cur.fetchone() if cur else None
+        return json.loads(row[0]) if row else None
+
+    # items は [(ns, key, value, ttl, updated)]。1 トランザクションでまとめて書く
+    def set_many(self, items):
+        self.writes += len(items)
+        self._write([
+            (
+                "INSERT OR REPLACE INTO kv (ns, key, value, expires, updated) VALUES (?, ?, ?, ?, ?)",
+                (ns, key, json.dumps(value, ensure_ascii=False, separators=(",", ":")), updated + ttl, updated),
+            )
+            for ns, key, value, ttl, updated in items
+        ])
+
+    def delete(self, ns, key):
+        self._write([("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))])
+
+    # since より後に書かれたものを [(key, value, updated)] で返す
+    def changed(self, ns, since):
+        self.reads += 1
+        cur = self._run(
+            "SELECT key, value, updated FROM kv WHERE ns = ? AND updated > ? AND expires > ?",
+            (ns, since, time.time()),
+        )
+        return [(key, json.loads(value), updated) for key, value, updated in cur or []]
+
+    # 期限切れを消し、多すぎたら古く書かれたものから消す
+    def purge(self):
+        self._write([
+            ("DELETE FROM kv WHERE expires <= ?", (time.time(),)),
+            (
+                "DELETE FROM kv WHERE (ns, key) IN (SELECT ns, key FROM kv ORDER BY updated LIMIT "
+                "max((SELECT COUNT(*) FROM kv) - ?, 0))",
+                (self.max_rows,),
+            ),
+        ])
+
+    def stats(self):
+        cur = self._run("SELECT COUNT(*) FROM kv")
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "rows": cur.fetchone()[0] if cur else None,
+            "maxRows": self.max_rows,
+            "reads": self.reads,
+            "writes": self.writes,
+            "errors": self.errors,
+        }
+
+    def close(self):
+        with self._write_lock:
+            for conn in (self._reader, self._writer):
+                if conn is not None:
+                    conn.close()
+            self._reader = self._writer = None
+
+
+_backends = {"sqlite": SQLiteStore}
+store = None
+_pending = {}  # (ns, key) -> (value, ttl, updated)。同じキーは最後のものだけ書く
+
+
+def register(name, factory):
+    _backends[name] = factory
+
+
+def _store():
+    global store
+    if store is None and BACKEND in _backends:
+        store = _backends[BACKEND]()
+    return store
+
+
+# ===============================
+# 各モジュールから使う関数（共有しない設定なら何もしない）
+# ===============================
+def get(ns, key):
+    s = _store()
+    return s.get(ns, key) if s else None
+
+
+# 書き込み待ちに積むだけ。時刻は積んだ時点のもの（health の last writer wins に使う）
+def put(ns, key, value, ttl):
+    if _store():
+        _pending[(ns, key)] = (value, ttl, time.time())
+
+
+def delete(ns, key):
+    _pending.pop((ns, key), None)
+    s = _store()
+    if s:
+        s.delete(ns, key)
+
+
+def changed(ns, since):
+    s = _store()
+    return s.changed(ns, since) if s else []
+
+
+async def flush():
+    s = _store()
+    if not s or not _pending:
+        return
+
+    items = [(ns, key, value, ttl, updated) for (ns, key), (value, ttl, updated) in _pending.items()]
+    _pending.clear()
+    await asyncio.to_thread(s.set_many, items)
+
+
+async def flush_loop(interval=FLUSH_INTERVAL):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await flush()
+    finally:
+        await flush()
+
+
+async def purge_loop(interval=PURGE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        s = _store()
+        if s:
+            await asyncio.to_thread(s.purge)
+
+
+def close():
+    global store
+    if store is not None:
+        store.close()
+        store = None
+
+
+def snapshot():
+    s = _store()
+    return {**s.stats(), "pending": len(_pending)} if s else {"backend": "none"}
@@ -0,0 +1,165 @@
+import os
+
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+import health
+import proxycache
+import videoinfo
+from upstream import hedged_json, media_client
+
+# ===============================
+# Upstream Sources
+# ===============================
+# app.py と music.py（/music の APIRouter）の両方から使う上流の設定と取得処理。
+# ルーターが app を import しないようにここにまとめる
+
+# 環境変数（カンマ区切り）で差し替えられる（bench/ の偽インスタンスに向けるときなど）
+def env_list(name, default):
+    value = os.environ.get(name)
+    if not value:
+        return default
+    return [v.strip().rstrip("/") for v in value.split(",") if v.strip()]
+
+VIDEO_APIS = env_list("VIDEO_APIS", [
+    "https://iv.melmac.space",
+    "https://pol1.iv.ggtyler.dev",
+    "https://cal1.iv.ggtyler.dev",
+    "https://invidious.0011.lt",
+    "https://yt.omada.cafe",
+])
+
+SEARCH_APIS = env_list("SEARCH_APIS", VIDEO_APIS)
+
+COMMENTS_APIS = env_list("COMMENTS_APIS", [
+    "https://invidious.lunivers.trade",
+    "https://invidious.ducks.party",
+    "https://super8.absturztau.be",
+    "https://invidious.nikkosphere.com",
+    "https://yt.omada.cafe",
+    "https://iv.melmac.space",
+    "https://iv.duti.dev",
+])
+
+# エンドポイントごとの上流レイテンシ予算（秒）
+LATENCY_BUDGET = {
+    "search": 10,
+    "video": 10,
+    "channel": 10,
+    "comments": 10,
+    "streamurl": 10,
+}
+
+# レスポンスキャッシュの TTL（秒）
+CACHE_TTL = {
+    "search": 300,
+    "video": 3600,
+    "channel": 1800,
+    "comments": 600,
+}
+
+# /api/v1/search の accept。空のリストは「結果なし」という正しい答えなので受け取ってヘッジを終える
+# （打ち間違いや最後のページの次で、インスタンスを「使えない応答」と数えないように）
+def search_accept(d):
+    return isinstance(d, list) and (not d or any(isinstance(v, dict) and v.get("videoId") for v in d))
+
+# ===============================
+# Video Info
+# ===============================
+# /api/v1/videos/{id} は videoinfo に 1 本化して共有する
+async def get_video_info(video_id, formats=False, accept=None):
+    async def fetch(upstream_accept):
+        return await hedged_json(
+            health.order(VIDEO_APIS),
+            f"/api/v1/videos/{video_id}",
+            accept=upstream_accept,
+            budget=LATENCY_BUDGET["streamurl" if formats else "video"],
+            shape=lambda d: isinstance(d, dict) and bool(d),
+        )
+
+    return await videoinfo.get(video_id, fetch, formats=formats, accept=accept)
+
+# ===============================
+# Proxy（googlevideo を Range 付きで中継・キャッシュ）
+# ===============================
+# "bytes=a-b" / "bytes=a-" / "bytes=-n" を (start, end) に。複数範囲は非対応で None
+def parse_range(header, size):
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+
+    first, _, last = header[6:].strip().partition("-")
+
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start = size - int(last)
+            end = size - 1
+    except ValueError:
+        return None
+
+    start = max(start, 0)
+    end = min(end, size - 1)
+
+    if start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="Range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+
+    return start, end
+
+# fmt（adaptiveFormats の 1 つ）のバイト列を Range 付きで返す
+async def proxy_format(request, video_id, fmt):
+    itag = str(fmt.get("itag"))
+    url = fmt["url"]
+    media_type = (fmt.get("type") or "application/octet-stream").split(";")[0]
+    range_header = request.headers.get("range")
+
+    try:
+        size = int(fmt.get("clen") or 0)
+    except ValueError:
+        size = 0
+
+    if size <= 0:
+        headers = {"Range": range_header} if range_header else {}
+        client = media_client()
+        try:
+            r = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+        except httpx.HTTPError as e:
+            print("media request error:", repr(e))
+            raise HTTPException(status_code=502, detail="Upstream media unavailable")
+        passed = {
+            k: r.headers[k]
+            for k in ("content-length", "content-range", "accept-ranges")
+            if k in r.headers
+        }
+        return StreamingResponse(
+            proxycache.passthrough(r),
+            status_code=r.status_code,
+            media_type=media_type,
+            headers=passed,
+            # 本体が一度も読まれずに終わっても上流の接続を返す
+            background=BackgroundTask(r.aclose),
+        )
+
+    byte_range = parse_range(range_header, size)
+    start, end = byte_range or (0, size - 1)
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+    }
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    return StreamingResponse(
+        proxycache.stream_range(video_id, itag, url, start, end, size),
+        status_code=206 if byte_range else 200,
+        media_type=media_type,
+        headers=headers,
+    )
@@ -0,0 +1,149 @@
+import asyncio
+import heapq
+import os
+import unicodedata
+from bisect import bisect_left, insort
+
+# ===============================
+# Search Suggest
+# ===============================
+# 検索されたクエリと、返したタイトル・チャンネル名を正規化したキーの昇順配列に持ち、
+# 前方一致を二分探索で引く。人気度は足し込み、compact のたびに減衰させて上限まで削る。
+# 1〜2 文字の prefix は一致するキーが多すぎるので、prefix ごとの重い順 TOP_K を別に持っておく
+MAX_TERMS = int(os.environ.get("SUGGEST_MAX_TERMS", "50000"))
+COMPACT_INTERVAL = float(os.environ.get("SUGGEST_COMPACT_INTERVAL", "600"))
+
+# 重み。結果のあったクエリはタイトルより強く効かせる
+QUERY_WEIGHT = 5.0
+TITLE_WEIGHT = 1.0
+AUTHOR_WEIGHT = 1.0
+
+DECAY = 0.5
+MIN_WEIGHT = 0.25
+MAX_LENGTH = 100
+
+# この長さまでの prefix は _top から返す。TOP_K は /api/suggest の limit の上限と同じ
+SHORT_PREFIX = 2
+TOP_K = 20
+
+_terms = {}  # key -> [weight, 表示用の文字列]
+_keys = []
+_top = {}  # 短い prefix -> その prefix の key（重い順とは限らない, 最大 TOP_K）
+
+stats = {"added": 0, "queries": 0, "compactions": 0, "dropped": 0}
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return " ".join(text.split())[:MAX_LENGTH]
+
+
+def add(text, weight=TITLE_WEIGHT):
+    if not isinstance(text, str):
+        return
+
+    key = normalize(text)
+    if not key:
+        return
+
+    entry = _terms.get(key)
+    if entry is None:
+        _terms[key] = [weight, " ".join(text.split())[:MAX_LENGTH]]
+        insort(_keys, key)
+    else:
+        entry[0] += weight
+
+    _offer(key)
+    stats["added"] += 1
+
+    # 次の compact を待たずに上限の 1.2 倍で削る
+    if len(_terms) > MAX_TERMS * 1.2:
+        compact(decay=1.0)
+
+
+# compact の間は重みが増えるだけなので、増えたキーを短い prefix の TOP_K に入れ直せば正確なまま保てる
+def _offer(key):
+    weight = _terms[key][0]
+
+    for n in range(1, min(SHORT_PREFIX, len(key)) + 1):
+        top = _top.setdefault(key[:n], [])
+        if key in top:
+            continue
+        if len(top) < TOP_K:
+            top.append(key)
+            continue
+
+        lightest = min(range(len(top)), key=lambda i: _terms[top[i]][0])
+        if weight > _terms[top[lightest]][0]:
+            top[lightest] = key
+
+
+def _rebuild_top():
+    _top.clear()
+
+    for key in sorted(_terms, key=lambda k: _terms[k][0], reverse=True):
+        for n in range(1, min(SHORT_PREFIX, len(key)) + 1):
+            top = _top.setdefault(key[:n], [])
+            if len(top) < TOP_K:
+                top.append(key)
+
+
+def add_query(q):
+    add(q, QUERY_WEIGHT)
+
+
+def add_videos(items):
+    for v in items or []:
+        if isinstance(v, dict):
+            add(v.get("title"), TITLE_WEIGHT)
+            add(v.get("author"), AUTHOR_WEIGHT)
+
+
+def suggest(prefix, limit=10):
+    stats["queries"] += 1
+    prefix = normalize(prefix)
+    if not prefix:
+        return []
+
+    if len(prefix) <= SHORT_PREFIX:
+        candidates = [_terms[k] for k in _top.get(prefix, ())]
+    else:
+        candidates = []
+        i = bisect_left(_keys, prefix)
+        while i < len(_keys) and _keys[i].startswith(prefix):
+            candidates.append(_terms[_keys[i]])
+            i += 1
+
+    return [text for _, text in heapq.nlargest(limit, candidates, key=lambda e: e[0])]
+
+
+# 重みを減衰させ、MIN_WEIGHT 未満と MAX_TERMS を超えた分（軽い順）を捨てる
+def compact(decay=DECAY):
+    global _keys
+
+    for entry in _terms.values():
+        entry[0] *= decay
+
+    keep = [k for k, e in _terms.items() if e[0] >= MIN_WEIGHT]
+    if len(keep) > MAX_TERMS:
+        keep = heapq.nlargest(MAX_TERMS, keep, key=lambda k: _terms[k][0])
+
+    before = len(_terms)
+    kept = {k: _terms[k] for k in keep}
+    _terms.clear()
+    _terms.update(kept)
+    _keys = sorted(_terms)
+    _rebuild_top()
+
+    stats["compactions"] += 1
+    stats["dropped"] += before - len(_terms)
+
+
+async def compact_loop(interval=COMPACT_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        compact()
+
+
+def snapshot():
+    return {"terms": len(_terms), "maxTerms": MAX_TERMS, **stats}
@@ -0,0 +1,4 @@
+import os
+
+# テストではワーカー間の共有ストアを使わない（/tmp の SQLite に書かない）
+os.environ.setdefault("SHARED_BACKEND", "none")
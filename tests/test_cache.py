@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+import cache
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(cache, "responses", cache.TTLCache())
+    monkeypatch.setattr(cache, "_refreshing", {})
+
+
+def fetcher(*values):
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0)
+        value = values[min(len(calls), len(values)) - 1]
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    return fetch, calls
+
+
+def test_miss_then_hit():
+    fetch, calls = fetcher({"v": 1})
+
+    async def run():
+        return await cache.cached("video:a", 60, fetch), await cache.cached("video:a", 60, fetch)
+
+    assert asyncio.run(run()) == (({"v": 1}, cache.MISS), ({"v": 1}, cache.HIT))
+    assert len(calls) == 1
+
+
+def test_failed_miss_is_not_stored():
+    fetch, calls = fetcher(None, {"v": 1})
+
+    async def run():
+        return await cache.cached("video:a", 60, fetch), await cache.cached("video:a", 60, fetch)
+
+    assert asyncio.run(run()) == ((None, cache.MISS), ({"v": 1}, cache.MISS))
+    assert len(calls) == 2
+
+
+def test_stale_while_revalidate():
+    cache.responses.set("video:a", {"v": 1}, -1)
+    fetch, calls = fetcher({"v": 2})
+
+    async def run():
+        # 期限切れでも stale の間はすぐ返し、裏の更新は 1 本だけ
+        first = await cache.cached("video:a", 60, fetch)
+        second = await cache.cached("video:a", 60, fetch)
+        await asyncio.gather(*cache._refreshing.values())
+        return first, second, await cache.cached("video:a", 60, fetch)
+
+    first, second, third = asyncio.run(run())
+    assert first == ({"v": 1}, cache.STALE)
+    assert second == ({"v": 1}, cache.STALE)
+    assert third == ({"v": 2}, cache.HIT)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("result", [None, RuntimeError("upstream down")])
+def test_failed_refresh_keeps_stale_value(result):
+    cache.responses.set("video:a", {"v": 1}, -1)
+    fetch, calls = fetcher(result)
+
+    async def run():
+        await cache.cached("video:a", 60, fetch)
+        await asyncio.gather(*cache._refreshing.values())
+        return cache.responses.get("video:a")[0]
+
+    assert asyncio.run(run()) == {"v": 1}
+    assert len(calls) == 1
+
+
+def test_stale_if_error():
+    # stale の期間も過ぎたものは、上流が取れなかったときだけ使う
+    cache.responses.set("video:a", {"v": 1}, -cache.STALE_SECONDS - 1)
+    fetch, calls = fetcher(None)
+
+    assert asyncio.run(cache.cached("video:a", 60, fetch)) == ({"v": 1}, cache.STALE_IF_ERROR)
+    assert len(calls) == 1
+
+
+def test_expired_stale_entry_is_replaced():
+    cache.responses.set("video:a", {"v": 1}, -cache.STALE_SECONDS - 1)
+    fetch, _ = fetcher({"v": 2})
+
+    assert asyncio.run(cache.cached("video:a", 60, fetch)) == ({"v": 2}, cache.MISS)
+
+
+def test_miss_waits_for_running_prefetch():
+    fetch, calls = fetcher({"v": 1})
+
+    async def run():
+        cache.prefetch("video:a", 60, fetch)
+        return await cache.cached("video:a", 60, fetch)
+
+    assert asyncio.run(run()) == ({"v": 1}, cache.HIT)
+    assert len(calls) == 1
+
+
+def test_negative_result_is_remembered():
+    fetch, calls = fetcher(None, {"v": 1})
+
+    async def run():
+        return (
+            await cache.cached("search:a", 60, fetch, negative=True),
+            await cache.cached("search:a", 60, fetch, negative=True),
+        )
+
+    assert asyncio.run(run()) == ((None, cache.MISS), (None, cache.HIT))
+    assert len(calls) == 1
+
+
+def test_negative_result_expires(monkeypatch):
+    monkeypatch.setattr(cache, "NEGATIVE_TTL", -1)
+    fetch, calls = fetcher(None, {"v": 1})
+
+    async def run():
+        await cache.cached("search:a", 60, fetch, negative=True)
+        return await cache.cached("search:a", 60, fetch, negative=True)
+
+    assert asyncio.run(run()) == ({"v": 1}, cache.MISS)
+    assert len(calls) == 2
+
+
+def test_negative_prefetch_keeps_stale_value():
+    cache.responses.set("search:a", {"v": 1}, -1)
+    fetch, _ = fetcher(None)
+
+    async def run():
+        cache.prefetch("search:a", 60, fetch, negative=True)
+        await asyncio.gather(*cache._refreshing.values())
+        return cache.responses.get("search:a")[0]
+
+    assert asyncio.run(run()) == {"v": 1}
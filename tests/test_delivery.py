@@ -0,0 +1,100 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+import delivery
+
+BIG = {"items": ["x" * 40] * 100}
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.get("/json")
+    def json_route(request: Request):
+        return delivery.json_response(request, BIG, "hit")
+
+    @app.get("/small")
+    def small():
+        return PlainTextResponse("ok")
+
+    @app.get("/video")
+    def video():
+        return Response(b"\0" * 4096, media_type="video/mp4")
+
+    @app.get("/range")
+    def ranged():
+        return Response("x" * 4096, media_type="text/plain", headers={"Content-Range": "bytes 0-4095/9000"})
+
+    @app.get("/stream")
+    def stream():
+        return StreamingResponse(iter([b"x" * 4096, b"y" * 4096]), media_type="application/x-ndjson")
+
+    return TestClient(delivery.Compression(app))
+
+
+def test_json_response_etag_and_304(client):
+    r = client.get("/json", headers={"Accept-Encoding": "identity"})
+    assert r.status_code == 200
+    assert r.headers["x-cache"] == "hit"
+    etag = r.headers["etag"]
+    assert not etag.startswith("W/")
+
+    for header in (etag, f'"other", {etag}', f"W/{etag}", "W/\"other\", W/" + etag):
+        r = client.get("/json", headers={"If-None-Match": header, "Accept-Encoding": "identity"})
+        assert r.status_code == 304, header
+        assert r.headers["etag"] == etag
+
+    r = client.get("/json", headers={"If-None-Match": '"other"', "Accept-Encoding": "identity"})
+    assert r.status_code == 200
+
+
+def test_compressed_json_gets_weak_etag(client):
+    r = client.get("/json", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in r.headers["vary"]
+    assert r.headers["etag"].startswith('W/"')
+    assert r.json() == BIG
+
+    # 弱い ETag で来た再検証も 304
+    r = client.get("/json", headers={"Accept-Encoding": "gzip", "If-None-Match": r.headers["etag"]})
+    assert r.status_code == 304
+
+
+@pytest.mark.parametrize("path", ["/small", "/video", "/range", "/stream"])
+def test_not_compressed(client, path):
+    r = client.get(path, headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0, deflate", None),
+    ("identity", None),
+    (None, None),
+    ("br, gzip", "br" if delivery.brotli is not None else "gzip"),
+])
+def test_negotiate(header, expected):
+    assert delivery.negotiate(header) == expected
+
+
+def test_compress_roundtrip():
+    body = b"hello " * 500
+    assert gzip.decompress(delivery.compress(body, "gzip")) == body
+
+
+@pytest.mark.parametrize("header, expected", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", W/"abc"', True),
+    ("*", True),
+    ('"x"', False),
+    (None, False),
+])
+def test_not_modified(header, expected):
+    scope = {"type": "http", "headers": [(b"if-none-match", header.encode())] if header else []}
+    assert delivery.not_modified(Request(scope), '"abc"') is expected
@@ -0,0 +1,56 @@
+import feeds
+from feeds import ChannelFeed
+
+
+def page(*ids, continuation="c1", source="http://inv.test"):
+    return {
+        "videos": [{"videoId": i} for i in ids],
+        "continuation": continuation,
+        "source": source,
+    }
+
+
+def ids(feed):
+    return [v["videoId"] for v in feed.videos]
+
+
+def test_merge_prepends_new_videos():
+    feed = ChannelFeed("UC1", page("c", "b", "a"))
+
+    assert feed.merge(page("e", "d", "c", "b", continuation="c2", source="http://other.test")) == 2
+    assert ids(feed) == ["e", "d", "c", "b", "a"]
+    # 古いページへの continuation は最初のページのまま
+    assert feed.continuation == "c1"
+    assert feed.base == "http://other.test"
+
+
+def test_merge_without_new_videos():
+    feed = ChannelFeed("UC1", page("c", "b", "a"))
+
+    assert feed.merge(page("c", "b", "a")) == 0
+    assert ids(feed) == ["c", "b", "a"]
+
+
+def test_merge_keeps_feed_on_empty_page():
+    feed = ChannelFeed("UC1", page("c", "b", "a"))
+
+    assert feed.merge(page(continuation=None)) == 0
+    assert ids(feed) == ["c", "b", "a"]
+    assert feed.continuation == "c1"
+
+
+def test_merge_resets_when_whole_page_is_new():
+    feed = ChannelFeed("UC1", page("c", "b", "a"))
+
+    assert feed.merge(page("f", "e", "d", continuation="c9")) == 3
+    assert ids(feed) == ["f", "e", "d"]
+    assert feed.continuation == "c9"
+
+
+def test_merge_resets_when_too_large(monkeypatch):
+    monkeypatch.setattr(feeds, "MAX_FEED_VIDEOS", 4)
+    feed = ChannelFeed("UC1", page("c", "b", "a"))
+
+    assert feed.merge(page("e", "d", "c", continuation="c2")) == 2
+    assert ids(feed) == ["e", "d", "c"]
+    assert feed.continuation == "c2"
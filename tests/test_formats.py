@@ -0,0 +1,132 @@
+import pytest
+
+import formats
+from formats import FormatTable, parse_quality, primary_lang
+
+
+def video(itag, label, codec="avc1.4d401f", container="mp4", bitrate=1000000):
+    return {
+        "itag": itag,
+        "type": f'video/{container}; codecs="{codec}"',
+        "url": f"https://example.test/{itag}",
+        "qualityLabel": label,
+        "bitrate": str(bitrate),
+    }
+
+
+def audio(itag, lang=None, track=None, codec="mp4a.40.2", container="mp4", bitrate=128000):
+    f = {
+        "itag": itag,
+        "type": f'audio/{container}; codecs="{codec}"',
+        "url": f"https://example.test/{itag}",
+        "bitrate": str(bitrate),
+    }
+    if lang:
+        f["language"] = lang
+    if track:
+        f["audioTrack"] = track
+    return f
+
+
+@pytest.fixture
+def table():
+    return FormatTable([
+        video("303", "1080p60", codec="vp09.00.41.08", container="webm", bitrate=5000000),
+        video("137", "1080p", bitrate=4000000),
+        video("298", "720p60", bitrate=3000000),
+        video("136", "720p", bitrate=2000000),
+        video("135", "480p", bitrate=1000000),
+        audio("251", track={"id": "en-US.10", "displayName": "English original"},
+              codec="opus", container="webm", bitrate=160000),
+        audio("140", lang="en", bitrate=130000),
+        audio("139", track={"id": "ja.4"}, bitrate=64000),
+    ])
+
+
+@pytest.fixture(autouse=True)
+def exclude_english(monkeypatch):
+    monkeypatch.setattr(formats, "AUDIO_EXCLUDE_LANGS", ["en"])
+
+
+def itag(f):
+    return f["itag"] if f else None
+
+
+def test_parse_quality():
+    assert parse_quality("best") == (None, None)
+    assert parse_quality("720") == (720, None)
+    assert parse_quality("720p") == (720, None)
+    assert parse_quality("720P60") == (720, 60)
+
+
+@pytest.mark.parametrize("quality, expected", [
+    ("720", "136"),
+    ("720p", "136"),
+    ("720p60", "298"),
+    ("1080p", "137"),
+    ("1080p60", "303"),
+    ("best", "303"),
+])
+def test_video_by_quality(table, quality, expected):
+    assert itag(table.video(quality)) == expected
+
+
+def test_video_falls_back_to_lower_height(table):
+    assert itag(table.video("900")) == "136"
+    assert itag(table.video("900p60")) == "298"
+    # どれより低ければ一番低い高さ
+    assert itag(table.video("144")) == "135"
+
+
+def test_video_prefers_ios(table):
+    assert itag(table.video("best", prefer_ios=True)) == "137"
+    assert itag(table.video("1080p60", prefer_ios=True)) == "303"
+
+
+def test_qualities(table):
+    assert list(table.qualities()) == ["1080p60", "1080p", "720p60", "720p", "480p"]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("en-US.10", "en"),
+    ("ja_JP", "ja"),
+    ("JA", "ja"),
+    ("ja.4", "ja"),
+    (None, ""),
+])
+def test_primary_lang(value, expected):
+    assert primary_lang(value) == expected
+
+
+def test_audio_excludes_languages_with_suffixes(table):
+    # en-US.10 と en はどちらも除外され、ビットレートの低い ja.4 が選ばれる
+    assert itag(table.audio()) == "139"
+
+
+def test_audio_by_lang(table):
+    assert itag(table.audio("ja-JP")) == "139"
+    assert itag(table.audio("en")) == "251"
+    assert itag(table.audio("en-GB", prefer_ios=True)) == "140"
+
+
+def test_audio_unknown_lang_falls_back(table):
+    assert itag(table.audio("fr")) == "251"
+
+
+def test_audio_exclusion_without_alternatives(monkeypatch):
+    monkeypatch.setattr(formats, "AUDIO_EXCLUDE_LANGS", ["en", "ja"])
+    table = FormatTable([audio("140", lang="en"), audio("139", lang="ja", bitrate=64000)])
+    assert itag(table.audio()) == "140"
+
+
+def test_languages_and_lookup(table):
+    assert table.languages() == ["en", "ja"]
+    assert itag(table.format(136)) == "136"
+    assert table.format("999") is None
+
+
+def test_empty_table():
+    table = FormatTable([{"itag": "1", "type": "video/mp4"}, "bogus", None])
+    assert not table
+    assert table.video() is None
+    assert table.audio() is None
@@ -0,0 +1,172 @@
+import asyncio
+import os
+
+import pytest
+
+import muxcache
+from jobs import QueueFull, Scheduler
+from mux import MuxError
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(muxcache, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+# chunks を 1 つずつ出す fragmented な produce。gate がセットされるまで最後の chunk の前で止まる
+def producer(chunks, gate=None, fail=None):
+    state = {"started": 0, "closed": False}
+
+    def produce():
+        async def gen():
+            state["started"] += 1
+            try:
+                for n, chunk in enumerate(chunks):
+                    if gate is not None and n == len(chunks) - 1:
+                        await gate.wait()
+                    yield chunk
+                    await asyncio.sleep(0)
+                if fail:
+                    raise fail
+            finally:
+                state["closed"] = True
+
+        return gen()
+
+    return produce, state
+
+
+async def collect(stream):
+    return b"".join([chunk async for chunk in stream])
+
+
+def test_followers_share_one_job(cache_dir):
+    async def run():
+        scheduler = Scheduler(workers=1, queue_size=1)
+        produce, state = producer([b"a", b"b", b"c"])
+
+        job = scheduler.submit("k", produce, fragmented=True)
+        assert scheduler.submit("k", produce, fragmented=True) is job
+
+        results = await asyncio.gather(collect(scheduler.follow(job)), collect(scheduler.follow(job)))
+        await job.task
+        return scheduler, job, state, results
+
+    scheduler, job, state, results = asyncio.run(run())
+    assert results == [b"abc", b"abc"]
+    assert state["started"] == 1
+    assert scheduler.stats["deduped"] == 1
+    assert scheduler.stats["completed"] == 1
+    assert job.path == muxcache.path_for("k")
+    with open(job.path, "rb") as f:
+        assert f.read() == b"abc"
+
+
+def test_queue_full():
+    async def run():
+        scheduler = Scheduler(workers=1, queue_size=1)
+        gate = asyncio.Event()
+        produce, _ = producer([b"a", b"b"], gate)
+
+        jobs = [scheduler.submit(k, produce, fragmented=True) for k in ("a", "b")]
+        with pytest.raises(QueueFull) as e:
+            scheduler.submit("c", produce, fragmented=True)
+
+        gate.set()
+        await asyncio.gather(*(job.task for job in jobs))
+        return scheduler, e.value
+
+    scheduler, error = asyncio.run(run())
+    assert error.retry_after >= 1
+    assert scheduler.stats["rejected"] == 1
+    assert scheduler.stats["completed"] == 2
+
+
+def test_last_follower_leaving_cancels_job(cache_dir):
+    async def run():
+        scheduler = Scheduler(workers=1, queue_size=1)
+        gate = asyncio.Event()
+        produce, state = producer([b"a", b"b"], gate)
+        job = scheduler.submit("k", produce, fragmented=True)
+
+        stream = scheduler.follow(job)
+        assert await anext(stream) == b"a"
+        await stream.aclose()
+        await asyncio.gather(job.task, return_exceptions=True)
+        return scheduler, job, state
+
+    scheduler, job, state = asyncio.run(run())
+    assert scheduler.stats["cancelled"] == 1
+    assert state["closed"]
+    assert job.path is None
+    assert "k" not in scheduler.jobs
+    assert not [name for name in os.listdir(cache_dir) if name.endswith(".part")]
+
+
+def test_job_survives_while_a_follower_remains():
+    async def run():
+        scheduler = Scheduler(workers=1, queue_size=1)
+        gate = asyncio.Event()
+        produce, _ = producer([b"a", b"b"], gate)
+        job = scheduler.submit("k", produce, fragmented=True)
+
+        leaving = scheduler.follow(job)
+        staying = asyncio.create_task(collect(scheduler.follow(job)))
+        assert await anext(leaving) == b"a"
+        await leaving.aclose()
+
+        gate.set()
+        return scheduler, await staying
+
+    scheduler, data = asyncio.run(run())
+    assert data == b"ab"
+    assert scheduler.stats["completed"] == 1
+    assert scheduler.stats["cancelled"] == 0
+
+
+def test_follow_started_raises_before_first_byte():
+    async def run():
+        scheduler = Scheduler(workers=1, queue_size=1)
+        produce, _ = producer([], fail=MuxError("ffmpeg failed"))
+        job = scheduler.submit("k", produce, fragmented=True)
+        with pytest.raises(MuxError):
+            await scheduler.follow_started(job)
+        return scheduler
+
+    assert asyncio.run(run()).stats["failed"] == 1
+
+
+def test_follow_started_stream_close_cancels_job():
+    async def run():
+        scheduler = Scheduler(workers=1, queue_size=1)
+        gate = asyncio.Event()
+        produce, state = producer([b"a", b"b"], gate)
+        job = scheduler.submit("k", produce, fragmented=True)
+
+        stream = await scheduler.follow_started(job)
+        assert await anext(stream) == b"a"
+        await stream.aclose()
+        await asyncio.gather(job.task, return_exceptions=True)
+        return scheduler, state
+
+    scheduler, state = asyncio.run(run())
+    assert scheduler.stats["cancelled"] == 1
+    assert state["closed"]
+
+
+def test_file_job_and_wait(cache_dir):
+    async def run():
+        scheduler = Scheduler(workers=1, queue_size=1)
+
+        async def produce(out):
+            with open(out, "wb") as f:
+                f.write(b"mp4")
+            return True
+
+        job = scheduler.submit("k", produce)
+        return await scheduler.wait(job)
+
+    path = asyncio.run(run())
+    assert path == muxcache.path_for("k")
+    assert open(path, "rb").read() == b"mp4"
@@ -0,0 +1,42 @@
+import asyncio
+import os
+
+import pytest
+
+import muxcache
+import proxycache
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(proxycache, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(proxycache, "_evicting", None)
+    return tmp_path
+
+
+def test_evict_runs_off_loop_and_coalesces(cache_dir, monkeypatch):
+    monkeypatch.setattr(proxycache, "MAX_BYTES", 2048)
+    for n in range(4):
+        path = cache_dir / f"block_{n}.bin"
+        path.write_bytes(b"x" * 1024)
+        os.utime(path, (n, n))
+
+    runs = []
+    evict_dir = muxcache.evict_dir
+
+    def counting(*args):
+        runs.append(1)
+        return evict_dir(*args)
+
+    monkeypatch.setattr(muxcache, "evict_dir", counting)
+
+    async def run():
+        # 走り出す前・走っている間の呼び出しは 1 本にまとまる
+        for _ in range(5):
+            proxycache.schedule_evict()
+        await proxycache._evicting
+
+    asyncio.run(run())
+    assert sorted(os.listdir(cache_dir)) == ["block_2.bin", "block_3.bin"]
+    assert len(runs) == 1
+    assert proxycache.stats["evicted"] >= 2
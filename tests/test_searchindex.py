@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+import searchindex
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(searchindex, "DB_PATH", str(tmp_path / "index.db"))
+    searchindex.close()
+    searchindex._write([
+        ("a1", "東京 猫 動画まとめ", "ねこch", None, 500, None, 1.0),
+        ("a2", "大阪の猫", "ねこch", None, 900, None, 2.0),
+        ("a3", "東京タワー 夜景", "tower", None, 100, None, 3.0),
+    ])
+    yield
+    searchindex.close()
+
+
+def ids(q):
+    return [r["videoId"] for r in asyncio.run(searchindex.search(q))]
+
+
+def test_long_terms_use_fts(index):
+    assert ids("東京タワー") == ["a3"]
+
+
+def test_short_terms_filter_fts_rows(index):
+    assert ids("動画まとめ 猫") == ["a1"]
+    assert ids("東京タワー 猫") == []
+
+
+def test_short_terms_only(index):
+    assert ids("猫") == ["a2", "a1"]
+    assert ids("東京") == ["a1", "a3"]
+
+
+def test_short_scan_is_bounded_to_recent_rows(index, monkeypatch):
+    monkeypatch.setattr(searchindex, "SHORT_SCAN_ROWS", 1)
+    assert ids("東京") == ["a3"]
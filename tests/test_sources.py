@@ -0,0 +1,27 @@
+import pytest
+from fastapi import HTTPException
+
+from sources import parse_range
+
+
+def test_parse_range_forms():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=900-", 1000) == (900, 999)
+    assert parse_range("bytes=-100", 1000) == (900, 999)
+    assert parse_range("bytes=500-5000", 1000) == (500, 999)
+
+
+def test_parse_range_ignored():
+    assert parse_range(None, 1000) is None
+    assert parse_range("items=0-1", 1000) is None
+    assert parse_range("bytes=0-1,5-6", 1000) is None
+    assert parse_range("bytes=a-b", 1000) is None
+
+
+@pytest.mark.parametrize("header", ["bytes=999999-", "bytes=-0", "bytes=1000-1000"])
+def test_parse_range_unsatisfiable(header):
+    with pytest.raises(HTTPException) as e:
+        parse_range(header, 1000)
+
+    assert e.value.status_code == 416
+    assert e.value.headers["Content-Range"] == "bytes */1000"
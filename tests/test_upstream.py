@@ -0,0 +1,188 @@
+import asyncio
+
+import httpx
+import pytest
+
+import health
+import upstream
+
+
+@pytest.fixture
+def mock_upstream(monkeypatch):
+    def install(handler, host="http://inv.test"):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setitem(upstream._clients, host, client)
+        monkeypatch.setitem(health._instances, host, health.InstanceHealth(host))
+        return health.get(host)
+
+    return install
+
+
+@pytest.mark.parametrize("status, body", [
+    (404, {"error": "This video may be deleted"}),
+    (500, {"error": "This video is private"}),
+    (403, None),
+])
+def test_answered_errors_keep_circuit_closed(mock_upstream, status, body):
+    def handler(request):
+        if body is None:
+            return httpx.Response(status, text="forbidden")
+        return httpx.Response(status, json=body)
+
+    h = mock_upstream(handler)
+
+    async def run():
+        for _ in range(health.FAILURE_THRESHOLD * 2):
+            assert await upstream.try_json("http://inv.test/api/v1/videos/bogus") is None
+
+    asyncio.run(run())
+    assert h.state == health.CLOSED
+    assert h.consecutive_failures == 0
+    # 5xx は応答があってもエラー率に入れて重みを下げる
+    if status >= 500:
+        assert h.error_rate > 0.5
+    else:
+        assert h.errors == 0
+        assert h.error_rate == 0
+
+
+def test_unparseable_5xx_opens_circuit(mock_upstream):
+    h = mock_upstream(lambda request: httpx.Response(502, text="<html>bad gateway</html>"))
+
+    async def run():
+        for _ in range(health.FAILURE_THRESHOLD):
+            await upstream.try_json("http://inv.test/api/v1/videos/abc")
+
+    asyncio.run(run())
+    assert h.state == health.OPEN
+
+
+def test_connect_error_opens_circuit(mock_upstream):
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    h = mock_upstream(handler)
+
+    async def run():
+        for _ in range(health.FAILURE_THRESHOLD):
+            await upstream.try_json("http://inv.test/api/v1/videos/abc")
+
+    asyncio.run(run())
+    assert h.state == health.OPEN
+
+
+def test_single_flight_follower_survives_leader_cancel():
+    flights = upstream.SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "data"
+
+    async def run():
+        leader = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", fetch))
+        await asyncio.sleep(0.01)
+
+        leader.cancel()
+        assert await follower == "data"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(run())
+    assert calls == [1]
+    assert flights.deduped == 1
+
+
+def test_single_flight_cancels_when_everyone_leaves():
+    flights = upstream.SingleFlight()
+    cancelled = []
+
+    async def fetch():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def run():
+        waiters = [asyncio.create_task(flights.do("k", fetch)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for w in waiters:
+            w.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert cancelled == [1]
+    assert flights.stats()["inflight"] == 0
+
+
+def test_strict_accept_does_not_starve_lenient_callers(monkeypatch):
+    monkeypatch.setattr(upstream, "flights", upstream.SingleFlight())
+    calls = []
+
+    async def fake_try_json(url, params=None):
+        calls.append(url)
+        await asyncio.sleep(0.02)
+        return {"itags": ["136"]}
+
+    monkeypatch.setattr(upstream, "try_json", fake_try_json)
+    shape = lambda d: isinstance(d, dict)
+    bases = ["http://a.test", "http://b.test"]
+
+    async def run():
+        # 先に来た呼び出しの accept が厳しくても、後から来た呼び出しは共有の結果を使える
+        strict = asyncio.create_task(upstream.hedged_json(
+            bases, "/api/v1/videos/x", accept=lambda d: "999" in d["itags"], shape=shape, budget=1,
+        ))
+        await asyncio.sleep(0)
+        lenient = asyncio.create_task(upstream.hedged_json(
+            bases, "/api/v1/videos/x", accept=bool, shape=shape, budget=1,
+        ))
+        return await strict, await lenient
+
+    (strict_data, _), (lenient_data, lenient_base) = asyncio.run(run())
+    assert strict_data is None
+    assert lenient_data == {"itags": ["136"]}
+    assert lenient_base in bases
+
+
+def test_hedged_json_falls_through_failed_instances(monkeypatch):
+    monkeypatch.setattr(upstream, "flights", upstream.SingleFlight())
+
+    async def fake_try_json(url, params=None):
+        return None if url.startswith("http://a.test") else {"ok": True}
+
+    monkeypatch.setattr(upstream, "try_json", fake_try_json)
+
+    data, base = asyncio.run(upstream.hedged_json(["http://a.test", "http://b.test"], "/api/v1/stats"))
+    assert data == {"ok": True}
+    assert base == "http://b.test"
+
+
+def test_empty_search_result_ends_hedge_without_penalty(monkeypatch):
+    from sources import search_accept
+
+    monkeypatch.setattr(upstream, "flights", upstream.SingleFlight())
+    calls = []
+
+    async def fake_try_json(url, params=None):
+        calls.append(url)
+        return []
+
+    monkeypatch.setattr(upstream, "try_json", fake_try_json)
+    bases = ["http://a.test", "http://b.test"]
+    for base in bases:
+        monkeypatch.setitem(health._instances, base, health.InstanceHealth(base))
+
+    data, base = asyncio.run(upstream.hedged_json(bases, "/api/v1/search", {"q": "typo"}, accept=search_accept))
+    assert data == []
+    assert base == "http://a.test"
+    assert len(calls) == 1
+    assert all(health.get(b).unusable == 0 for b in bases)
+    # 形の違う応答はこれまでどおり「使えない」
+    assert not search_accept({"error": "x"})
+    assert not search_accept([{"title": "no id"}])
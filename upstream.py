@@ -0,0 +1,313 @@
+import asyncio
+import os
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+
+import health
+import metrics
+
+# ===============================
+# Upstream Client
+# ===============================
+# Invidious インスタンスごとに keep-alive プールを共有する
+TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "6"))
+CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", "3"))
+
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get("UPSTREAM_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_PER_HOST = int(os.environ.get("UPSTREAM_MAX_KEEPALIVE", "10"))
+KEEPALIVE_EXPIRY = 30
+
+# googlevideo はホストが rrN---sn-xxx ごとに違うので、メディア用はホスト別にせず 1 つのクライアントで持つ
+MEDIA_MAX_CONNECTIONS = int(os.environ.get("UPSTREAM_MEDIA_MAX_CONNECTIONS", "100"))
+MEDIA_MAX_KEEPALIVE = int(os.environ.get("UPSTREAM_MEDIA_MAX_KEEPALIVE", "20"))
+
+# ヘッジ遅延（秒）。0 なら直近の成功レイテンシの p90 を使う
+HEDGE_DELAY = float(os.environ.get("UPSTREAM_HEDGE_DELAY", "0"))
+HEDGE_DELAY_DEFAULT = 1.5
+HEDGE_DELAY_MIN = 0.2
+
+HEADERS = {
+    "User-Agent": "Mozilla/5.0"
+}
+
+# h2 が入っていれば HTTP/2 を使う
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+_clients = {}
+_media_client = None
+_latencies = deque(maxlen=200)
+
+
+def host_of(url):
+    p = urlsplit(url)
+    return f"{p.scheme}://{p.netloc}"
+
+
+def _new_client(max_connections, max_keepalive):
+    return httpx.AsyncClient(
+        http2=HTTP2,
+        headers=HEADERS,
+        timeout=httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        follow_redirects=True,
+    )
+
+
+# Invidious インスタンス用（インスタンスの数だけ）
+def get_client(url):
+    host = host_of(url)
+    client = _clients.get(host)
+
+    if client is None or client.is_closed:
+        client = _clients[host] = _new_client(MAX_CONNECTIONS_PER_HOST, MAX_KEEPALIVE_PER_HOST)
+
+    return client
+
+
+# googlevideo などのメディア用。接続プールは httpx がホストごとに持ち、keepalive_expiry で閉じる
+def media_client():
+    global _media_client
+
+    if _media_client is None or _media_client.is_closed:
+        _media_client = _new_client(MEDIA_MAX_CONNECTIONS, MEDIA_MAX_KEEPALIVE)
+
+    return _media_client
+
+
+async def try_json(url, params=None):
+    host = host_of(url)
+    health.begin(host)
+    start = time.monotonic()
+    outcome = "error"
+    try:
+        r = await get_client(url).get(url, params=params)
+        if r.status_code != 200:
+            outcome = "status"
+            if _answered(r):
+                # 存在しない / 非公開の動画 ID などにインスタンスが答えただけなので、サーキットには数えない
+                latency = time.monotonic() - start
+                health.record_rejected(host, latency, error=r.status_code >= 500)
+                _observe(host, "rejected", latency)
+                return None
+        else:
+            try:
+                data = r.json()
+            except ValueError as e:
+                outcome = "parse"
+                print("request error:", e)
+            else:
+                latency = time.monotonic() - start
+                _latencies.append(latency)
+                health.record_success(host, latency)
+                _observe(host, "ok", latency)
+                return data
+    except asyncio.CancelledError:
+        health.abort(host, time.monotonic() - start)
+        _observe(host, "cancelled", time.monotonic() - start)
+        raise
+    except httpx.TimeoutException as e:
+        outcome = "timeout"
+        print("request error:", repr(e))
+    except Exception as e:
+        print("request error:", e)
+    _observe(host, outcome, time.monotonic() - start)
+    health.record_failure(host)
+    return None
+
+
+# 4xx か、エラーでも JSON の本文（Invidious の {"error": ...}）を返したなら、インスタンス自体は生きている
+def _answered(r):
+    if 400 <= r.status_code < 500:
+        return True
+    try:
+        r.json()
+    except ValueError:
+        return False
+    return True
+
+
+def _observe(host, outcome, elapsed):
+    metrics.upstream_requests.observe(elapsed, host, outcome)
+    metrics.upstream_outcomes.inc(host, outcome)
+    metrics.timing("upstream", elapsed)
+
+
+def hedge_delay():
+    if HEDGE_DELAY > 0:
+        return HEDGE_DELAY
+
+    if len(_latencies) < 20:
+        return HEDGE_DELAY_DEFAULT
+
+    samples = sorted(_latencies)
+    p90 = samples[int(len(samples) * 0.9) - 1]
+    return min(max(p90, HEDGE_DELAY_MIN), TIMEOUT)
+
+
+# ===============================
+# Single Flight
+# ===============================
+# 同じキーの同時リクエストは 1 本の上流取得にまとめて結果を共有する。
+# 待っている全員がキャンセルされたら取得自体もキャンセルする
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.deduped = 0
+
+    async def do(self, key, fn):
+        call = self._calls.get(key)
+
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.calls += 1
+        else:
+            self.deduped += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self):
+        return {
+            "inflight": len(self._calls),
+            "calls": self.calls,
+            "deduped": self.deduped,
+        }
+
+
+flights = SingleFlight()
+
+
+# ===============================
+# Hedged Request
+# ===============================
+# 同じ path + params の同時呼び出しは flights で 1 本にまとめる。
+# まとめた 1 本は shape（その path を呼ぶ全員に共通の形のチェック）を通った結果で決め、
+# 各自の accept はそのあとで見て、通らなければ自分で取り直す（shape すら通らなければ誰が取り直しても同じ）。
+# accept が呼び出しごとに違う（特定の itag が要るなど）ときは shape を渡すこと
+async def hedged_json(bases, path, params=None, accept=None, budget=None, shape=None):
+    if accept is None:
+        accept = bool
+    if shape is None:
+        shape = accept
+
+    key = (path, tuple(sorted((params or {}).items())))
+    data, base = await flights.do(key, lambda: _hedged(bases, path, params, shape, budget))
+
+    if data is not None and not _accepts(accept, data):
+        data, base = await _hedged(bases, path, params, accept, budget)
+
+    return data, base
+
+
+# 形の違う JSON（dict の代わりに list など）で accept が例外を出したら、使えない応答として扱う
+def _accepts(accept, data):
+    try:
+        return bool(accept(data))
+    except Exception as e:
+        print("unusable response:", repr(e))
+        return False
+
+
+# 先頭のインスタンスに投げ、hedge_delay 以内に返らなければ次を追加で投げる。
+# 失敗したら即座に次へ。最初に accept を通った結果を採用し、残りはキャンセル。
+async def _hedged(bases, path, params, accept, budget):
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (budget or TIMEOUT * 2)
+    delay = hedge_delay()
+
+    bases = list(bases)
+    queue = list(bases)
+    pending = {}
+    # "/api/v1/videos/xxx" → "videos"（何番目のインスタンスが答えたかを API ごとに数える）
+    api = path.split("/")[3] if path.startswith("/api/v1/") else path
+
+    try:
+        while queue or pending:
+            if queue:
+                base = queue.pop(0)
+                task = asyncio.create_task(try_json(f"{base}{path}", params))
+                pending[task] = base
+
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=min(delay, remaining) if queue else remaining,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+
+            for task in done:
+                base = pending.pop(task)
+                data = task.result()
+                if data is None:
+                    continue
+                if _accepts(accept, data):
+                    metrics.upstream_answered.inc(api, str(bases.index(base)))
+                    return data, base
+                health.record_unusable(base)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    metrics.upstream_answered.inc(api, "none")
+    return None, None
+
+
+# ===============================
+# Background Probe
+# ===============================
+async def probe_loop(bases, interval):
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.gather(
+            *(try_json(f"{base}/api/v1/stats") for base in bases),
+            return_exceptions=True,
+        )
+
+
+async def close_clients():
+    global _media_client
+    clients = list(_clients.values())
+    _clients.clear()
+    if _media_client is not None:
+        clients.append(_media_client)
+        _media_client = None
+
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            print("client close error:", e)
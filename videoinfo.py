@@ -0,0 +1,148 @@
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+import shared
+from formats import FormatTable
+
+# ===============================
+# Video Info Store
+# ===============================
+# /api/v1/videos/{id} の結果を video_id ごとに 1 つ持ち、
+# /api/video・/api/stream・/api/streamurl で共有する。
+# メタデータは長め、adaptiveFormats は googlevideo URL の expire 直前まで。
+# 取ったものは共有ストアにも入れ、他のワーカーは自分のメモリに無いときそこから読む
+MAX_ENTRIES = int(os.environ.get("VIDEOINFO_MAX_ENTRIES", "500"))
+META_TTL = int(os.environ.get("VIDEOINFO_META_TTL", "21600"))
+
+# expire が取れないときの URL の寿命と、expire の何秒前に捨てるか
+FORMATS_TTL_DEFAULT = 3600
+EXPIRE_MARGIN = 300
+
+META_FIELDS = (
+    "title",
+    "author",
+    "authorId",
+    "description",
+    "viewCount",
+    "lengthSeconds",
+    "published",
+    "videoThumbnails",
+)
+
+
+class VideoInfo:
+    def __init__(self, video_id, data, base, fetched=None):
+        now = fetched or time.time()
+        self.video_id = video_id
+        self.base = base
+        self.fetched = now
+        self.meta = {k: data.get(k) for k in META_FIELDS}
+        self.formats = [
+            f for f in data.get("adaptiveFormats") or []
+            if isinstance(f, dict) and f.get("url")
+        ]
+        self.table = FormatTable(self.formats)
+        self.meta_expires = now + META_TTL
+        self.formats_expires = formats_expiry(self.formats, now)
+
+    def meta_fresh(self, now):
+        return now < self.meta_expires
+
+    def formats_fresh(self, now):
+        return bool(self.formats) and now < self.formats_expires
+
+    def shared_record(self):
+        return {
+            "data": {**self.meta, "adaptiveFormats": self.formats},
+            "base": self.base,
+            "fetched": self.fetched,
+        }
+
+
+def url_expire(url):
+    try:
+        expire = parse_qs(urlsplit(url).query).get("expire")
+        return int(expire[0]) if expire else None
+    except (ValueError, TypeError):
+        return None
+
+
+def formats_expiry(formats, now):
+    expires = [e for e in (url_expire(f.get("url")) for f in formats) if e]
+    if not expires:
+        return now + FORMATS_TTL_DEFAULT
+    return min(expires) - EXPIRE_MARGIN
+
+
+_store = OrderedDict()
+stats = {"hits": 0, "misses": 0, "expired": 0}
+
+
+def _remember(info):
+    _store[info.video_id] = info
+    _store.move_to_end(info.video_id)
+    while len(_store) > MAX_ENTRIES:
+        _store.popitem(last=False)
+    return info
+
+
+def put(video_id, data, base):
+    info = _remember(VideoInfo(video_id, data, base))
+    ttl = max(info.meta_expires, info.formats_expires) - info.fetched
+    if ttl > 0:
+        shared.put("videoinfo", video_id, info.shared_record(), ttl)
+    return info
+
+
+# 他のワーカーが取ったもの。手元の info より新しいときだけ使う
+def _load(video_id, info):
+    stored = shared.get("videoinfo", video_id)
+    if stored is None or (info is not None and stored["fetched"] <= info.fetched):
+        return info
+    return _remember(VideoInfo(video_id, stored["data"], stored["base"], stored["fetched"]))
+
+
+def _usable(info, now, formats, accept):
+    if info is None or not info.meta_fresh(now):
+        return False
+    if not formats:
+        return True
+    return info.formats_fresh(now) and (accept is None or accept(info.table))
+
+
+# fetch(accept) は上流から (data, base) を取る coroutine 関数。
+# formats=True のときは adaptiveFormats が有効期限内で、accept(FormatTable) を満たすものを返す
+async def get(video_id, fetch, formats=False, accept=None):
+    info = _store.get(video_id)
+    now = time.time()
+
+    if info is not None:
+        _store.move_to_end(video_id)
+
+    if not _usable(info, now, formats, accept):
+        info = _load(video_id, info)
+
+    if _usable(info, now, formats, accept):
+        stats["hits"] += 1
+        return info
+
+    if formats and info is not None and info.formats and not info.formats_fresh(now):
+        stats["expired"] += 1
+
+    stats["misses"] += 1
+
+    upstream_accept = lambda d: isinstance(d, dict) and bool(d)
+    if formats:
+        upstream_accept = lambda d: isinstance(d, dict) and (accept or bool)(FormatTable(d.get("adaptiveFormats")))
+
+    data, base = await fetch(upstream_accept)
+    if not data:
+        return None
+
+    return put(video_id, data, base)
+
+
+def snapshot():
+    return {"entries": len(_store), "maxsize": MAX_ENTRIES, **stats}